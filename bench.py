@@ -0,0 +1,223 @@
+
+import sys # .argv
+import os
+import re
+import json
+import time
+import platform
+import tempfile
+import tracemalloc
+
+import yaml
+
+import build
+import maze
+
+# The phases of building a project that are measured, in order. Each is given the results of the
+# ones before it (see runPhases( )).
+PHASES = [ "dump", "load", "assemble", "create", "update", "destroy", "write" ]
+
+def runPhases ( parsed, workdir, measure ):
+
+    """Run each of PHASES on the maze project 'parsed' (see maze.generateMaze( )), with any files
+    written to the directory 'workdir'. Each phase is called through measure( name, function ),
+    which must call the function and return its result."""
+
+    filename = os.path.join( workdir, "maze.yaml" )
+
+    def dump ( ):
+        with open( filename, "w" ) as fh:
+            yaml.dump( parsed, fh, Dumper = getattr( yaml, "CSafeDumper", yaml.SafeDumper ) )
+
+    def load ( ):
+        with open( filename, "rb" ) as fh:
+            return yaml.load( fh.read( ), Loader = build.YamlLoader )
+
+    def write ( ):
+        with open( os.path.join( workdir, "maze-build.txt" ), "w" ) as fh:
+            build.writeCommands( fh, project.iterCreate( ) )
+
+        with open( os.path.join( workdir, "maze-build.jsonl" ), "w" ) as fh:
+            build.writeSegments( fh, project.iterSegments( "c" ) )
+
+    measure( "dump", dump )
+    loaded = measure( "load", load )
+    project = measure( "assemble", lambda: build.assembleProject( loaded ) )
+
+    # The lists themselves are thrown away straight after, but they're what the phases produce, so
+    # they count towards the memory each needs at its peak.
+    measure( "create", lambda: len( project.toCreate( ) ) )
+    measure( "update", lambda: len( project.toUpdate( ) ) )
+    measure( "destroy", lambda: len( project.toDestroy( ) ) )
+    measure( "write", write )
+
+def timePhases ( parsed ):
+
+    """Return a dictionary of how many seconds each of PHASES takes on 'parsed'."""
+
+    seconds = { }
+
+    def measure ( name, function ):
+
+        started = time.perf_counter( )
+        result = function( )
+        seconds[ name ] = time.perf_counter( ) - started
+
+        return result
+
+    with tempfile.TemporaryDirectory( ) as workdir:
+        runPhases( parsed, workdir, measure )
+
+    return seconds
+
+def profilePhases ( parsed ):
+
+    """Return a dictionary of the memory each of PHASES uses on 'parsed', as measured by
+    tracemalloc: the most allocated at once while it ran ("peak"), and how much more is allocated
+    after it than before ("retained"), in bytes. (This is done separately from timePhases( ), as
+    tracing slows everything down a great deal.)"""
+
+    memory = { }
+
+    def measure ( name, function ):
+
+        before = tracemalloc.get_traced_memory( )[0]
+        tracemalloc.reset_peak( )
+
+        result = function( )
+
+        ( current, peak ) = tracemalloc.get_traced_memory( )
+        memory[ name ] = { "peak": peak - before, "retained": current - before }
+
+        return result
+
+    tracemalloc.start( )
+
+    try:
+        with tempfile.TemporaryDirectory( ) as workdir:
+            runPhases( parsed, workdir, measure )
+
+    finally:
+        tracemalloc.stop( )
+
+    return memory
+
+def benchmark ( roomCount, memory = True, **world ):
+
+    """Generate a maze of 'roomCount' rooms (the keyword arguments 'world' are passed on to
+    maze.generateMaze( )), and return a record of how long, and how much memory unless 'memory' is
+    false, each of PHASES takes on it."""
+
+    parsed = maze.generateMaze( roomCount, seed = 0, **world )
+
+    result = { "rooms": roomCount, "world": world,
+               "exits": sum( len( room.get( "LINKS", { } ) ) for room in parsed["rooms"].values( ) ),
+               "seconds": timePhases( parsed ) }
+
+    if memory:
+        result["memory"] = profilePhases( parsed )
+
+    return result
+
+def environment ( ):
+
+    """Return a record of what the benchmarks were run on, so results from different versions
+    and machines can be told apart."""
+
+    revision = None
+
+    try:
+        with os.popen( "git -C " + os.path.dirname( os.path.abspath( __file__ ) ) + \
+                       " rev-parse --short HEAD 2>" + os.devnull ) as fh:
+            revision = fh.read( ).strip( ) or None
+
+    except OSError:
+        pass
+
+    return { "revision": revision,
+             "python": platform.python_version( ),
+             "machine": platform.machine( ),
+             "libyaml": build.YamlLoader is not yaml.SafeLoader,
+             "time": time.strftime( "%Y-%m-%dT%H:%M:%S" ) }
+
+
+if __name__ == "__main__":
+
+    if "--help" in sys.argv:
+        print ( """Usage:
+
+python bench.py [--links=N] [--props=N] [--prop-size=N] [--globals] \\
+    [--no-postscripts] [--layout=grid|tree|clusters] [--no-memory] \\
+    [--output=bench-results.json] [roomCount ...]
+
+Generates mazes (see maze.py) of each of the given numbers of rooms (default 100,
+1000 and 10000), and times each phase of building them: writing and loading the
+YAML, assembling the project, producing the -c, -u and -d commands, and writing
+the build files. Each phase's memory use is then measured separately, unless
+--no-memory is given. The results are printed and written as JSON to the
+--output file.
+
+--links is how many exits each room has (default 2-4), --props how many extra
+properties, of --prop-size characters; --globals puts the name and POSTSCRIPT
+every room shares into an ALL block, and --no-postscripts leaves them out.
+--layout links the rooms up as a connected grid, tree or clusters of rooms (see
+topology.py) instead of at random, with --links exits each on average (default
+3).
+""" )
+        quit ( )
+
+    world = { }
+    memory = True
+    output = "bench-results.json"
+    sizes = [ ]
+
+    for arg in sys.argv[1:]:
+
+        match = re.match( "^--(links|props|prop-size)=([0-9]+)$", arg )
+
+        if match:
+            world[ { "links": "linksPerRoom", "props": "extraProps", "prop-size": "propSize" }[ match.group( 1 ) ] ] = \
+                int( match.group( 2 ) )
+
+        elif arg == "--globals":
+            world["useGlobals"] = True
+
+        elif arg == "--no-postscripts":
+            world["postscripts"] = False
+
+        elif arg.startswith( "--layout=" ):
+            world["layout"] = arg[ len( "--layout=" ): ]
+
+        elif arg == "--no-memory":
+            memory = False
+
+        elif arg.startswith( "--output=" ):
+            output = arg[ len( "--output=" ): ]
+
+        else:
+            sizes += [ int( arg ) ]
+
+    results = [ ]
+
+    for roomCount in sizes or [ 100, 1000, 10000 ]:
+
+        result = benchmark( roomCount, memory, **world )
+        results += [ result ]
+
+        print( "%d rooms, %d exits:" % ( result["rooms"], result["exits"] ) )
+
+        for phase in PHASES:
+
+            line = "    %-10s %8.3fs" % ( phase, result["seconds"][ phase ] )
+
+            if memory:
+                line += "  %10.0f bytes/room peak, %10.0f retained" % \
+                        ( result["memory"][ phase ]["peak"] / roomCount,
+                          result["memory"][ phase ]["retained"] / roomCount )
+
+            print( line )
+
+    with open( output, "w" ) as fh:
+        json.dump( { "environment": environment( ), "results": results }, fh, indent = 1 )
+
+    print( "Results written to " + output + "." )
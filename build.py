@@ -1,7 +1,24 @@
 
 import sys # .argv
 import re
-import copy # .deepcopy( )
+import collections.abc
+import json
+import hashlib
+import sqlite3
+import difflib
+import os.path
+import pickle
+import concurrent.futures
+import contextlib
+import time
+import tracemalloc
+import cProfile
+
+try:
+    import resource # .getrusage, for peak memory use; not available on Windows.
+
+except ImportError:
+    resource = None
 
 import yaml
 
@@ -25,11 +42,246 @@ def mergeDict( source, dest ):
                 # It WILL override if it's just a string or None or something.
                 dest[key] = source[key]
 
+# Optional transformations of the commands produced, which can be turned on with the 'optimise'
+# config option or -O on the command line. (See Project.optimisations( ).)
+OPTIMISATIONS = [ "hoist", "teleports", "coalesce" ]
+
+# Commands which only affect the object they're given (before the =), so that if that's 'here' they
+# can be given the room itself instead, and run from anywhere. For the ones that take another object
+# after the =, that mustn't be 'here' or 'me' either.
+HERE_COMMANDS = [ "@set", "@propset", "@desc", "@name", "@succ", "@osucc", "@fail", "@ofail", "@drop",
+                  "@odrop", "@lock", "@unlock", "@chown", "@link", "@unlink", "@tel", "@teleport" ]
+HERE_OBJECT_COMMANDS = [ "@lock", "@chown", "@link", "@tel", "@teleport" ]
+
+# The @commands that set the properties of an object's messages, and those properties.
+MESSAGE_PROPS = { "@succ": "_/sc", "@osucc": "_/osc", "@fail": "_/fl", "@ofail": "_/ofl", "@drop": "_/dr",
+                  "@odrop": "_/odr", "@desc": "_/de" }
+MESSAGE_COMMANDS = { prop: cmd for ( cmd, prop ) in MESSAGE_PROPS.items( ) }
+
+def parseWrite ( command ):
+
+    """If 'command' just writes a property or flag on an object, return a tuple of the object, the
+    property (or, for flags, "!flag " and the flag's name), and the whole command as the shortest
+    of its equivalent forms (see MESSAGE_PROPS.) Otherwise return None."""
+
+    match = re.match( "^@set ([^=]+)=([^:]*):(.*)$", command )
+
+    if match:
+
+        ( target, prop, val ) = match.groups( )
+
+        if prop in MESSAGE_COMMANDS:
+            command = min( command, MESSAGE_COMMANDS[ prop ] + " " + target + "=" + val, key = len )
+
+        return ( target, prop, command )
+
+    match = re.match( "^(@[a-z]+) ([^=]+)=(.*)$", command )
+
+    if match and match.group( 1 ) in MESSAGE_PROPS:
+        return ( match.group( 2 ), MESSAGE_PROPS[ match.group( 1 ) ], command )
+
+    match = re.match( "^@set ([^=]+)=!?([A-Za-z]+)$", command )
+
+    if match:
+        return ( match.group( 1 ), "!flag " + match.group( 2 ).upper( ), command )
+
+    return None
+
+def coalesce ( commands ):
+
+    """Return the list of MUCK commands 'commands' without the property and flag writes (see
+    parseWrite( )) that a later one overwrites before anything else can see them, and with each of
+    those left in its shortest form. Any command that isn't such a write is kept, and nothing is
+    moved past it; neither is anything in an lsedit session."""
+
+    k = [ ]
+    written = { }
+    editing = False
+
+    for command in commands:
+
+        if editing:
+            k += [ command ]
+            editing = command != ".end"
+            continue
+
+        write = parseWrite( command )
+
+        if write is None:
+            k += [ command ]
+            written = { }
+            editing = command.startswith( "lsedit " )
+            continue
+
+        ( target, prop, command ) = write
+
+        if ( target, prop ) in written:
+            k[ written[ ( target, prop ) ] ] = None
+
+        written[ ( target, prop ) ] = len( k )
+        k += [ command ]
+
+    return [ command for command in k if command is not None ]
+
+def relocate ( command, ref ):
+
+    """Return 'command' changed, if need be, so that it can be run from anywhere instead of only
+    from inside the room called 'ref' (i.e. with 'here' replaced by 'ref'), or None if it can't
+    be (see HERE_COMMANDS.)"""
+
+    match = re.match( "^(@[A-Za-z]+) +(here|[#$][^=]*)(=(.*))?$", command )
+
+    if not match or match.group( 1 ).lower( ) not in HERE_COMMANDS:
+        return None
+
+    ( cmd, target, rest, val ) = match.groups( )
+
+    if cmd.lower( ) in HERE_OBJECT_COMMANDS and val and re.search( "(?i)\\b(here|me)\\b", val ):
+        return None
+
+    if target == "here":
+        return cmd + " " + ref + ( rest or "" )
+
+    return command
+
+def parseProp ( propName, val ):
+
+    """Parse a property/property-value combination as given in a project file: return the name the
+    property is actually stored under and its value. If the property ends with a #, the value is a
+    list of lines (for lsedit.)"""
+
+    # Otherwise, a yaml > with multiple paragraphs will give you only one new-line
+    # between the paragraphs. So this is like a special syntax for 'extra newline.'
+    val = val.replace ( "**", "\n" )
+
+    # The same few property names get used on a great many objects, so only keep one copy of each.
+    if propName[-1] == '#':
+        return ( sys.intern( propName[0:-1] ), val.split ( "\n" ) )
+
+    # We will also make MPI out of any newlines in ordinary string props.
+    return ( sys.intern( propName ), val.replace( "\n", "{nl}" ) )
+
+# The placeholders POSTSCRIPT commands and default exit messages can use (see
+# MuckObject.interpolateString( )), without the ! they begin with.
+PLACEHOLDERS = re.compile( r"!(R|N|\{(?:id|project|origin|dest|originID|destID)\})" )
+
+# Those that are the subject's, when an object interpolates a string about another.
+SUBJECT_PLACEHOLDERS = ( "R", "N", "{id}" )
+
+def compileTemplate ( string ):
+
+    """Split 'string' into a tuple of its text and the placeholders in it (see PLACEHOLDERS; e.g.
+    "R" or "{origin}"), alternately: text always comes first and last, even if it's empty, so a
+    string with no placeholders comes back as a tuple of just itself."""
+
+    return tuple( PLACEHOLDERS.split( string ) )
+
+class PropLayers ( collections.abc.MutableMapping ):
+
+    """A room's (or exit's) properties, on top of a dictionary of properties it shares with other
+    objects (e.g. those from the ALL block.) Reading falls through to the shared properties;
+    writing only ever changes the object's own. Iterates in the order the properties would have had
+    if they'd all been set one by one, shared ones first."""
+
+    __slots__ = ( "own", "base" )
+
+    def __init__ ( self, base ):
+
+        self.base = base
+        self.own = None             # Most objects never get any of their own; don't make a dict.
+
+    def __getitem__ ( self, key ):
+
+        if self.own and key in self.own:
+            return self.own[key]
+
+        return self.base[key]
+
+    def __setitem__ ( self, key, val ):
+
+        if self.own is None:
+            self.own = { }
+
+        self.own[key] = val
+
+    def __delitem__ ( self, key ):
+
+        # Shared properties can't be removed from here.
+        del self.own[key]
+
+    def __contains__ ( self, key ):
+
+        return key in self.base or ( self.own is not None and key in self.own )
+
+    def __iter__ ( self ):
+
+        yield from self.base
+
+        if self.own:
+            for key in self.own:
+                if key not in self.base:
+                    yield key
+
+    def __len__ ( self ):
+
+        return sum( 1 for key in self )
+
+def removeCommands ( regname, ref = None ):
+
+    """Return MUCK commands to remove the object registered as 'regname' (without the $), and its
+    registration. 'ref' is what to call the object by, if not $regname (e.g. its dbref.)"""
+
+    return [ "@recycle " + ( ref or "$" + regname ),
+             "@set " + "me=/_reg/" + regname + ":" ]
+
+def segment ( key, commands, idempotent = True, undo = None ):
+
+    """Return a segment: the commands for one step of an operation, which are sent together and
+    recorded as done together (see Project.iterSegments( ).) 'key' names what the segment is about,
+    normally an element's registered name. If running the commands twice would do any harm,
+    'idempotent' is false, and 'undo' is a list of commands that put things back as they were
+    before the segment was run (or None if there's no knowing), so that one that was interrupted
+    partway through can be cleared up and run again."""
+
+    return { "key": key, "commands": commands, "idempotent": idempotent, "undo": undo }
+
+def lastOfEach ( elems ):
+
+    """Yield the elements from the iterable 'elems', but of exits from the same room registered
+    under the same name (two exits to the same room, see LinkIndex.check( )), only the last, as a
+    dictionary of them by registered name would keep. The exits from a room always come together
+    (see Project.iterElements( )), so only those of one room are held at a time."""
+
+    held = { }
+    origin = None
+
+    for elem in elems:
+
+        if not isinstance( elem, Link ):
+            yield from held.values( )
+            held = { }
+            yield elem
+            continue
+
+        if elem.orig( ) != origin:
+            yield from held.values( )
+            held = { }
+            origin = elem.orig( )
+
+        held[ elem.regname( ) ] = elem
+
+    yield from held.values( )
+
 class MuckObject:
 
     """Generic 'muck object'. Won't actually create an object, but knows how to do the relatively
     universal property setting, etc."""
 
+    # There can be a great many of these, so they're kept as small as possible: no per-object
+    # __dict__, and the custom commands start out as a shared empty tuple.
+    __slots__ = ( "id", "_name", "_project", "_props", "_buildPostscript", "_destroyPostscript",
+                  "_regname" )
+
     def __init__ ( self, ID, project ):
 
         self.id = ID
@@ -45,30 +297,43 @@ class MuckObject:
         # Store the user's custom commands to help with creating / destroying this particular
         # object, or things related to it:
 
-        self._buildPostscript = [ ]
-        self._destroyPostscript = [ ]
+        self._buildPostscript = ( )
+        self._destroyPostscript = ( )
+
+        # Worked out the first time .regname( ) is called.
+        self._regname = None
+
+    def getID ( self ):
+
+        return self.id
 
     def regname ( self, projectID = "no-project" ):
 
         """Return the name used to register this room in the MUCK software, without a $
         prepended."""
 
-        return "autodig/" + self._project.name + "/" + self.id
+        if self._regname is None:
+            self._regname = "autodig/" + self._project.name + "/" + self.getID( )
+
+        return self._regname
+
+    def ref ( self ):
+
+        """Return what commands should call this object by: its dbref, if the project knows it
+        (see Project.useDbrefs( )), or else $ and its registered name."""
+
+        reg = self.regname( )
+
+        return self._project._dbrefs.get( reg ) or "$" + reg
 
     def setProp ( self, propName, val ):
 
         """Parse / record a particular property/property-value combination. If the property
         ends with a #, it will be saved on the room as a list."""
 
-        # Otherwise, a yaml > with multiple paragraphs will give you only one new-line
-        # between the paragraphs. So this is like a special syntax for 'extra newline.'
-        val = val.replace ( "**", "\n" )
+        ( propName, val ) = parseProp( propName, val )
 
-        if propName[-1] == '#':
-            self._props[propName[0:-1]] = val.split ( "\n" )
-        else:
-            # We will also make MPI out of any newlines in ordinary string props.
-            self._props[propName] = val.replace( "\n", "{nl}" )
+        self._props[propName] = val
 
     def addUserCommand ( self, cmd, context = "BUILD" ):
 
@@ -77,11 +342,11 @@ class MuckObject:
         .interpolateString( )."""
 
         if context == "BUILD":
-            self._buildPostscript += [ cmd ]
+            self._buildPostscript += ( cmd, )
             return cmd
 
         if context == "DESTROY":
-            self._destroyPostscript += [ cmd ]
+            self._destroyPostscript += ( cmd, )
             return cmd
 
         raise Exception( "Weird context for commands: '" + context + "'." )
@@ -92,7 +357,8 @@ class MuckObject:
         derivations of MuckObject should probably use it when building the object. This is
         distinctly different from the name the object is REGISTERED under."""
 
-        self._name = name
+        # Lots of objects end up with the same name ('Maze', '[N]orth;north;n' ...)
+        self._name = sys.intern( name ) if type( name ) == str else name
 
     def getName ( self ):
 
@@ -100,17 +366,47 @@ class MuckObject:
 
         return self._name
 
-    def interpolateString( self, string ):
+    def interpolateString( self, string, subject = None ):
 
-        """Return a (command) string with certain values replaced in: !R for object reference, !N
-        for self.getName( ). Not an actual parsing system, so ! anywhere else is just !."""
+        """Return a (command) string with certain values replaced in: !R for the object's
+        registered name, !N for its name, !{id} for its ID and !{project} for the project's name;
+        exits also have !{origin} and !{dest} for the names of the rooms they lead from and to, and
+        !{originID} and !{destID} for their IDs. If 'subject' is given, !R, !N and !{id} are its,
+        rather than this object's. Not an actual parsing system, so ! anywhere else is just !, as
+        is a placeholder the object doesn't have. Each string is only split up once for the whole
+        project (see Project.template( ).)"""
 
-        k = string
+        template = self._project.template( string )
 
-        k = k.replace( "!R", self.regname( ) )
-        k = k.replace( "!N", self.getName( ) )
+        if len( template ) == 1:
+            return string
 
-        return k
+        subject = subject or self
+        parts = list( template )
+
+        for i in range( 1, len( parts ), 2 ):
+            parts[i] = ( subject if parts[i] in SUBJECT_PLACEHOLDERS else self ).placeholder( parts[i] )
+
+        return "".join( parts )
+
+    def placeholder ( self, key ):
+
+        """Return the value of the placeholder 'key' (see PLACEHOLDERS) for this object: see
+        .interpolateString( )."""
+
+        if key == "R":
+            return self.regname( )
+
+        if key == "N":
+            return self.getName( )
+
+        if key == "{id}":
+            return self.getID( )
+
+        if key == "{project}":
+            return self._project.name
+
+        return "!" + key
 
     def props ( self ):
 
@@ -118,29 +414,132 @@ class MuckObject:
 
         return self._props
 
-    def realise ( self ):
+    def realise ( self, previous = None ):
 
         """Generate MUCK commands: (re)set all properties, etc., on the MuckObject (by
         registered name.)
 
+        If 'previous' is given, it should be a dictionary of the properties the object had the last
+        time it was realised (e.g. from .state( )); then only the differences are emitted, see
+        .propChanges( ).
+
         Normally, child types should use this implementation, and implement 'build' to
         create the object itself, and etc."""
 
+        if previous is None:
+            return self.propCommands( self.emittedProps( ) )
+
+        return self.propChanges( previous, self.emittedProps( ) )
+
+    def emittedProps ( self ):
+
+        """Dictionary of the properties that actually need to be set on the object on the MUCK --
+        normally just all of them."""
+
+        return self._props
+
+    def propChanges ( self, old, new ):
+
+        """Generate MUCK commands turning the properties in dictionary 'old' into those in 'new':
+        changed and added properties are set, properties that are gone are removed, and list
+        properties that existed before are edited line by line rather than rewritten."""
+
+        k = [ ]
+
+        for prop in old.keys( ):
+
+            if prop not in new:
+                k += self.removeProp( prop, type( old[prop] ) == list )
+
+        changed = { }
+
+        for prop in new.keys( ):
+
+            if old.get( prop ) == new[prop]:
+                continue
+
+            if type( new[prop] ) == list and type( old.get( prop ) ) == list:
+                k += self.listEdit( prop, old[prop], new[prop] )
+
+            else:
+                changed[prop] = new[prop]
+
+        return k + self.propCommands( changed )
+
+    def removeProp ( self, prop, isList = False ):
+
+        """Generate MUCK commands to remove property 'prop' (which was set as a list if 'isList')."""
+
+        if isList:
+            # lsedit keeps the lines in a propdir called prop#; removing that removes them all.
+            prop = prop + "#"
+
+        return [ "@set " + self.ref( ) + "=" + prop + ":" ]
+
+    def listEdit ( self, prop, old, new ):
+
+        """Generate an lsedit session turning the list property 'prop' from the lines in 'old' into
+        the lines in 'new' with as few edits as possible (or just rewriting it, if that's shorter.)"""
+
+        k = [ "lsedit " + self.ref( ) + "=" + prop ]
+
+        # Work from the end of the list backwards, so that the line numbers of the edits still to
+        # come aren't disturbed by the ones already made.
+        for ( tag, i1, i2, j1, j2 ) in reversed( difflib.SequenceMatcher( None, old, new, False ).get_opcodes( ) ):
+
+            if tag in [ "replace", "delete" ]:
+                k += [ ".del " + str( i1 + 1 ) + " " + str( i2 ) ]
+
+            if tag in [ "replace", "insert" ]:
+                k += [ ".i " + str( i1 + 1 ) ]
+                k += [ line + "  " for line in new[j1:j2] ]
+
+        k += [ ".end" ]
+
+        rewrite = self.propCommands( { prop: new } )
+
+        if len( rewrite ) <= len( k ):
+            return rewrite
+
+        return k
+
+    def propCommands ( self, props ):
+
+        """Generate MUCK commands setting each of the properties in the dictionary 'props' (which
+        need not be all of our own properties) on this object."""
+
         k = [ ]
+        ref = self.ref( )
 
-        for prop in self._props.keys ():
+        for prop in props.keys ():
 
-            if type( self._props[prop] ) == list:
-                k += [ "lsedit $" + self.regname ( ) + "=" + prop,
+            if type( props[prop] ) == list:
+                k += [ "lsedit " + ref + "=" + prop,
                        ".del 1 999" ]                                   # Make sure it's empty
-                k += [ line + "  " for line in self._props[prop] ]
+                k += [ line + "  " for line in props[prop] ]
                 k += [ ".end" ]
 
             else:
-                k += [ "@set $" + self.regname ( ) + "=" + prop + ":" + self._props[prop] ]
+                k += [ "@set " + ref + "=" + prop + ":" + props[prop] ]
 
         return k
 
+    def state ( self ):
+
+        """Return a plain (JSON-serialisable) record of everything about this object that ends up
+        on the MUCK: its name, properties and custom commands, plus a hash of all of those so that
+        two states can be compared cheaply. Used for the build manifest (see .toIncremental( ))."""
+
+        state = { "kind": type( self ).__name__.lower( ),
+                  "name": self.getName( ),
+                  "props": dict( self.emittedProps( ) ),
+                  "build": list( self._buildPostscript ),
+                  "destroy": list( self._destroyPostscript ) }
+
+        state["hash"] = hashlib.sha1( json.dumps( state, sort_keys = True ).encode( ) ).hexdigest( )
+
+        return state
+
     def postProcess( self, context = "BUILD" ):
 
         k = self._buildPostscript
@@ -156,15 +555,16 @@ class MuckObject:
 
         """Return MUCK commands to remove the object and its registration."""
 
-        return [ "@recycle " + "$" + self.regname ( ),
-                 "@set " + "me=/_reg/" + self.regname ( ) + ":" ]
+        return removeCommands( self.regname( ), self.ref( ) )
 
 
 class Room ( MuckObject ):
 
+    __slots__ = ( "_parent", "_exits" )
+
     def __init__ ( self, ID, project ):
 
-        super ( Room, self ).__init__ ( ID, project )
+        super ( Room, self ).__init__ ( sys.intern( ID ), project )
 
         self._name = "Untitled Room"
         self._parent = ""
@@ -189,16 +589,116 @@ class Room ( MuckObject ):
 
         return self._exits
 
-    def getID( self ):
+    def setParent ( self, parent ):
 
-        return self.id
+        """Set the room this one should be parented to (its 'environment' on the MUCK), given as a
+        reference the MUCK understands, e.g. '$autodig/project/room' or '#0'. An empty string leaves
+        the choice to the MUCK."""
+
+        self._parent = parent
+
+    def getParent ( self ):
+
+        """Return the room's parent, as given to .setParent( )."""
+
+        return self._parent
+
+    def emittedProps ( self ):
+
+        """See also MuckObject.emittedProps( ). Properties the room will inherit from the
+        project's environment room anyway (see Project.hoistProps( )) are left out."""
+
+        hoisted = self._project._hoisted
+
+        if not hoisted or self._parent != "$" + self._project.environment( ).regname( ):
+            return self._props
+
+        return { prop: val for ( prop, val ) in self._props.items( )
+                 if prop not in hoisted or hoisted[prop] != val }
+
+    def state ( self ):
+
+        """See also MuckObject.state( )."""
+
+        state = super( Room, self ).state( )
+        state["parent"] = self._parent
+
+        return state
 
     def build ( self ):
 
         """Generate MUCK commands: create the room and write properties to it."""
 
-        return [ "@dig " + self._name + "==" + self.regname ( ) ] \
-                + self.realise ()
+        return [ "@dig " + self._name + "=" + self.parentRef( ) + "=" + self.regname ( ) ] \
+                + super( Room, self ).realise ()
+
+    def realise ( self, previous = None ):
+
+        """See also MuckObject.realise( ). Unless only the differences from 'previous' are
+        wanted, the room is also moved back into its parent, if it has one."""
+
+        if previous is None:
+            return self.reparent( ) + super( Room, self ).realise( )
+
+        return super( Room, self ).realise( previous )
+
+    def reparent ( self ):
+
+        """Generate MUCK commands: move the room into its parent room, if it has one."""
+
+        if not self._parent:
+            return [ ]
+
+        return [ "@tel " + self.ref( ) + "=" + self.parentRef( ) ]
+
+    def parentRef ( self ):
+
+        """Return what commands should call the room's parent by: like .ref( ), a dbref is used
+        instead of a registered name if one is known."""
+
+        if self._parent.startswith( "$" ):
+            return self._project.ref( self._parent[1:] )
+
+        return self._parent
+
+    def relocatedPostscript ( self ):
+
+        """Return the room's BUILD post-processing commands, as they'd need to be run from
+        somewhere else (see relocate( )), or None if any of them have to be run from inside the
+        room."""
+
+        k = [ ]
+
+        for line in super( Room, self ).postProcess( ):
+
+            command = relocate( line, self.ref( ) )
+
+            if command is None:
+                return None
+
+            k += [ command ]
+
+        return k
+
+    def movesItself ( self ):
+
+        """Return whether any of the room's BUILD post-processing commands teleport the room itself
+        somewhere (e.g. '@tel here=#63'), which makes that its parent instead of the one it was
+        given."""
+
+        if not any( line.lower( ).startswith( "@tel" ) for line in self._buildPostscript ):
+            return False
+
+        refs = [ "here", self.ref( ).lower( ), "$" + self.regname( ).lower( ) ]
+
+        for line in super( Room, self ).postProcess( ):
+
+            match = re.match( "^@tel(?:eport)? +([^=]+?) *=", line, re.IGNORECASE )
+
+            if match and match.group( 1 ).lower( ) in refs:
+                return True
+
+        return False
 
     def postProcess( self, context = "BUILD" ):
 
@@ -210,7 +710,7 @@ class Room ( MuckObject ):
 
             # I think on SpinDizzy this has to be 'tel ' + <roomDBRefOrID> -- but that doesn't work on
             # the test server I was using, so I don't know. Maybe it should be customisable?
-            k += [ "@tel me=" + "$" + self.regname( ) ]
+            k += [ "@tel me=" + self.ref( ) ]
             k += super( Room, self ).postProcess( )
 
         return k
@@ -222,12 +722,23 @@ class Link ( MuckObject ):
     #
     # (No, really an action.)
 
+    __slots__ = ( "_orig", "_dest", "_origRoom", "_destRoom", "_defaulted" )
+
     def __init__ ( self, orig, dest, project ):
 
-        self._orig = orig
-        self._dest = dest
+        self._orig = sys.intern( orig )
+        self._dest = sys.intern( dest )
+
+        # The rooms themselves, once a LinkIndex has looked them up.
+        self._origRoom = None
+        self._destRoom = None
+
+        # The properties .sge( ) filled in, and what with, so they're made again rather than kept
+        # if the rooms they're about change.
+        self._defaulted = None
 
-        super ( Link, self ).__init__ ( self.getID ( ), project )
+        # The ID is made from the origin and destination when it's needed (see .getID( ).)
+        super ( Link, self ).__init__ ( None, project )
 
         self._name = "[G]eneric [E]xit;exit;ge"
 
@@ -236,16 +747,50 @@ class Link ( MuckObject ):
         """Make sure our origin and destination are actually rooms registered to the project -- if
         not, raise a more-helpful error message/Exception."""
 
-        if not self._project.room( self._orig ):
+        # (Only whether they're there, which doesn't mean reading them from a RoomStore.)
+        if self._origRoom is None and self._orig not in self._project._rooms:
             raise Exception("Link.__init__: no such room to link from: '" + self._orig + "'!")
 
-        if not self._project.room( self._dest ):
+        if self._destRoom is None and self._dest not in self._project._rooms:
             raise Exception("Link.__init__: no such room to link to: '" + self._dest + "'!")
 
+    def origRoom ( self ):
+
+        """Return the Room this exit leads from, or None if the project has no such room."""
+
+        if self._origRoom is None:
+            return self._project.room( self._orig )
+
+        return self._origRoom
+
+    def destRoom ( self ):
+
+        """Return the Room this exit leads to, or None if the project has no such room."""
+
+        if self._destRoom is None:
+            return self._project.room( self._dest )
+
+        return self._destRoom
+
+    def aliases ( self ):
+
+        """Return the list of names the exit can be used by: its name split at the ;s, in lower
+        case."""
+
+        return [ alias.strip( ).lower( ) for alias in self._name.split( ";" ) if alias.strip( ) ]
+
     def getID ( self ):
 
         return "LINK-" + self._orig + "-TO-" + self._dest
 
+    def regname ( self, projectID = "no-project" ):
+
+        """See also MuckObject.regname( ). Unlike rooms' (which every exit leading to or from them
+        needs), an exit's registered name is only needed while its own commands are generated, so
+        it isn't worth keeping around."""
+
+        return "autodig/" + self._project.name + "/" + self.getID( )
+
     def orig( self ):
 
         """Get originating room-name."""
@@ -262,12 +807,13 @@ class Link ( MuckObject ):
 
         self.sanityCheck( )
 
-        return [ "@action " + self._name + "=$" + self._project.room( self._orig ).regname( ) + \
-                     "=" + self.regname( ),
-                 "@link " + "$" + self.regname( ) + "=$" + self._project.room( self._dest ).regname ( ) ] \
+        reg = self.regname( )
+
+        return [ "@action " + self._name + "=" + self.origRoom( ).ref( ) + "=" + reg,
+                 "@link " + self._project.ref( reg ) + "=" + self.destRoom( ).ref( ) ] \
                + self.realise( )
 
-    def realise ( self ):
+    def realise ( self, previous = None ):
 
         """See also MuckObject.realise( )."""
 
@@ -276,22 +822,32 @@ class Link ( MuckObject ):
         if self._project.config["sge"]:
             self.sge( )
 
-        k = [ ]
+        return super( Link, self ).realise( previous )
 
-        # Let's get ready to fool super.realise() into thinking we don't have certain special properties
-        # that need to be given as @commands instead. I'm aware this is probably not the best way to do
-        # this.
-        temp = self._props
+    def removeProp ( self, prop, isList = False ):
 
-        for cmd in [ "succ", "osucc", "drop", "odrop" ]:
+        """See also MuckObject.removeProp( ). Exit messages are cleared with their @command."""
+
+        if prop in [ "succ", "osucc", "drop", "odrop" ]:
+            return [ "@" + prop + " " + self.ref( ) + "=" ]
+
+        return super( Link, self ).removeProp( prop, isList )
 
-            if cmd in self._props:
-                k += [ "@" + cmd + " $" + self.regname( ) + "=" + self._props.pop( cmd ) ]
+    def propCommands ( self, props ):
 
-        k += super( Link, self ).realise( )
+        """See also MuckObject.propCommands( ). The exit messages are given as @commands rather
+        than as properties."""
 
-        # ...but we don't want to forget about said props in case we need to do this again...
-        self._props = temp
+        k = [ ]
+        ref = self.ref( )
+
+        for cmd in [ "succ", "osucc", "drop", "odrop" ]:
+
+            if cmd in props:
+                k += [ "@" + cmd + " " + ref + "=" + props[ cmd ] ]
+
+        k += super( Link, self ).propCommands( { prop: props[ prop ] for prop in props.keys( )
+                                                 if prop not in [ "succ", "osucc", "drop", "odrop" ] } )
 
         # Side note: you don't actually need to use the @commands. The properties _/osc, _/sc,
         # _/dr and _/odr work, according to help [@osucc and friends] on FuzzBall. By the time I
@@ -300,268 +856,2464 @@ class Link ( MuckObject ):
 
         return k
 
-    def sge ( self ):
+    def state ( self ):
 
-        """If any of succ (_/sc), osucc (_/osc), or odrop (_/odr) are unset, provide a generic
-        message."""
+        """See also MuckObject.state( ). Default exit messages are filled in first, so that they
+        count as part of the exit's state."""
 
         self.sanityCheck( )
 
-        for prop in [ ["succ", "_/sc"], ["osucc", "_/osc"], ["odrop", "_/odr"], ["drop", "_/dr"] ]:
+        if self._project.config["sge"]:
+            self.sge( )
 
-            if prop[0] in self._props or prop[1] in self._props:
-                pass
+        state = super( Link, self ).state( )
+        state["orig"] = self._orig
 
-            else:
-                if prop[0] == "succ":
-                    self.setProp( "succ", self._project.room( self._dest ).interpolateString( \
-                                            self._project.config["sge"]["succ"] or "You leave for !N." ) )
+        return state
 
-                if prop[0] == "osucc":
-                    self.setProp( "osucc", self._project.room( self._dest ).interpolateString( \
-                                            self._project.config["sge"]["osucc"] or "leaves for !N." ) )
+    def placeholder ( self, key ):
 
-                if prop[0] == "odrop":
-                    self.setProp( "osucc", self._project.room( self._orig ).interpolateString( \
-                                            self._project.config["sge"]["odrop"] or "arrives from !N." ) )
+        """See also MuckObject.placeholder( )."""
 
-                if prop[0] == "drop":
-                    if "drop" in self._project.config["sge"]:
-                        self._props["drop"] = self._project.room( self._dest ).interpolateString( \
-                                               self._project.config["sge"]["drop"] )
+        if key == "{origin}":
+            return self.origRoom( ).getName( )
 
-class Project:
+        if key == "{dest}":
+            return self.destRoom( ).getName( )
 
-    def __init__ ( self, name ):
+        if key == "{originID}":
+            return self._orig
 
-        self.name = name
+        if key == "{destID}":
+            return self._dest
 
-        self._rooms = { }
-        self._exits = [ ]
+        return super( Link, self ).placeholder( key )
 
-        self._buildPostscript  = [ ]
-        self._destroyPostscript = [ ]
+    def sge ( self ):
 
-        self.config = {
-            "sge?": True,
-            "sge": {
-                "osucc": None,
-                "succ": None,
-                "odrop": None
-            }
-        }
+        """If any of succ (_/sc), osucc (_/osc), or odrop (_/odr) are unset, provide a generic
+        message. In these, !R, !N and !{id} are the room the exit leads to (or, for odrop, from.)
+        Messages filled in by an earlier call are made again, in case those rooms have changed."""
 
-    def configure( self, key, val ):
+        self.sanityCheck( )
 
-        mergeDict( { key: val }, self.config )
+        config = self._project.config["sge"]
+        props = self._props
 
-    def addUserCommand ( self, cmd, context = "BUILD" ):
+        if self._defaulted:
+            for ( key, message ) in self._defaulted.items( ):
+                if props.get( key ) is message:
+                    del props[ key ]
 
-        if context == "BUILD":
-            self._buildPostscript += [ cmd ]
-            return cmd
+        defaults = { }
 
-        if context == "DESTROY":
-            self._destroyPostscript += [ cmd ]
-            return cmd
+        if "succ" not in props and "_/sc" not in props:
+            defaults["succ"] = self.defaultMessage( config["succ"] or "You leave for !N.", self.destRoom( ) )
 
-        raise Exception( "Weird context for commands: '" + context + "'." )
+        if "osucc" not in props and "_/osc" not in props:
+            defaults["osucc"] = self.defaultMessage( config["osucc"] or "leaves for !N.", self.destRoom( ) )
 
-    def applyProps ( self, props, room ):
+        if "odrop" not in props and "_/odr" not in props:
+            defaults["osucc"] = self.defaultMessage( config["odrop"] or "arrives from !N.", self.origRoom( ) )
 
-        """Apply the block of properties given ('props') to the room named in parameter
-        'room'. Parses all special properties such as 'NAME' and exits."""
+        if "drop" not in props and "_/dr" not in props and "drop" in config:
+            defaults["drop"] = self.defaultMessage( config["drop"], self.destRoom( ), False )
 
-        if not room in self._rooms.keys():
-            self._rooms[room] = Room ( room, self )
+        props.update( defaults )
+        self._defaulted = defaults
 
-        # Deal with adding 'user commands' to the room.
-        for ( context, commands ) in props.pop( "POSTSCRIPT", { } ).items( ):
-            for command in commands:
-                self._rooms[room].addUserCommand( command, context )
+    def defaultMessage ( self, string, subject, parse = True ):
 
-        #consumeVal( props, "NAME", lambda name: self._rooms[room].setName ( name ) )
-        self._rooms[room].setName ( props.pop ( "NAME", self._rooms[room].getName ( ) ) )
+        """Return the default message made from the template 'string' about the room 'subject' (see
+        .sge( )), parsed as a property's value would be (see parseProp( )) if 'parse' is true.
 
-        # Deal with making exits.
-        for (dest, keys) in props.pop( "LINKS", { } ).items( ):
+        The messages are the same for every exit to (or from) the same room, unless they name the
+        room at the other end, so otherwise each is only made once for each room (as long as it's
+        called the same), and only one copy of it is kept."""
 
-            # Sometimes, every now and then... (rather implausibly, the only reason I did was for a
-            # demonstration maze-y-thing) we might want to open two exits to the same room.  Of
-            # course we can't have two keys in a dictionary with the same value, and YAML just
-            # throws one of them out. So, I made another convention to remove underscores from the
-            # name before use, so we could have multiple unique keys leading to the same room.
-            dest = dest.replace("_", "")
+        messages = self._project._messages
+        key = ( string, parse, subject.id, subject._name )
+        message = messages.get( key )
 
-            k = Link( room, dest, self )
+        if message is not None:
+            return message
 
-            self._exits += [ k ]
-            self._rooms[ room ].addExit( k )
+        message = self.interpolateString( string, subject )
 
-            # If you don't actually care about setting exit messages just now, there should be a
-            # concise way to just make an exit, without subproperties.
-            if type( keys ) == str:
+        if parse:
+            message = parseProp( "succ", message )[1]
 
-                k.setName( keys )
+        message = sys.intern( message )
 
-            else:
+        if all( part in SUBJECT_PLACEHOLDERS or part == "{project}" for part in self._project.template( string )[1::2] ):
+            messages[ key ] = message
 
-                # Otherwise, exits get their own properties, etc., like everything else.
+        return message
 
-                k.setName( keys.pop( "NAME", "[G]eneric [E]xit;exit;ge" ) )
+class ProjectError ( Exception ):
 
-                for ( context, commands ) in props.pop( "POSTSCRIPT", { } ).items( ):
-                    for command in commands:
-                        self._rooms[room].addUserCommand( command, context )
+    """Raised when a project has problems that would stop it being built properly. All of them are
+    listed in the message, and in .problems."""
 
-                for prop in keys:
-                    k.setProp( prop, keys[prop] )
+    def __init__ ( self, problems ):
 
-        # Set the remaining properties (which are ordinary properties) on the Room.
-        for ( prop, val ) in props.items():
+        super( ProjectError, self ).__init__( "\n".join( [ "The project has problems:" ] + problems ) )
 
-            if type ( val ) == str:
-                self._rooms[room].setProp( prop, val.rstrip () )
+        self.problems = problems
 
-    def elements ( self, targets = None ):
+class LinkIndex:
+
+    """Which rooms the exits of a project lead out of and into. Built in a single pass over the
+    exits (see Project.index( )), which also resolves every exit's rooms once and for all and
+    collects everything wrong with the way the rooms are linked up, in .errors and .warnings. Only
+    the rooms' IDs are kept, not the exits themselves, so that it's just as small for a project
+    whose rooms are kept in a RoomStore."""
+
+    def __init__ ( self, project ):
+
+        self._project = project
+
+        self._destinations = { }    # room -> IDs of the rooms its exits lead to
+        self._origins = { }         # room -> IDs of the rooms with exits leading to it
+
+        self.errors = [ ]
+        self.warnings = [ ]
+
+        rooms = project._rooms
+
+        # Rooms kept in a RoomStore can be written out, and read back as new objects, at any time,
+        # so exits can't hang on to them.
+        resolve = type( rooms ) == dict
+
+        for room in rooms.values( ):
+
+            seen = { }              # alias -> exit with that alias
+            leading = { }           # room -> exit leading to it
+
+            for exit in room.exits( ):
+
+                if resolve:
+                    exit._origRoom = room
+                    exit._destRoom = rooms.get( exit.dest( ) )
+
+                if exit.dest( ) not in rooms:
+                    self.errors += [ "Exit '" + exit.getName( ) + "' in room '" + exit.orig( ) + \
+                                     "' leads to no such room: '" + exit.dest( ) + "'." ]
+
+                self._destinations.setdefault( room.getID( ), [ ] ).append( sys.intern( exit.dest( ) ) )
+
+                # An exit's registered name is made from the rooms it leads from and to.
+                other = leading.setdefault( exit.dest( ), exit )
+
+                if other is not exit:
+                    self.warnings += [ "Exits '" + other.getName( ) + "' and '" + exit.getName( ) + "' in room '" + \
+                                       exit.orig( ) + "' are both registered as '" + exit.regname( ) + \
+                                       "', so only the last can be found by it." ]
+
+                origins = self._origins.setdefault( sys.intern( exit.dest( ) ), [ ] )
+
+                if room.getID( ) not in origins[-1:]:
+                    origins += [ room.getID( ) ]
+
+                for alias in exit.aliases( ):
+
+                    other = seen.setdefault( alias, exit )
+
+                    if other is not exit:
+                        self.errors += [ "Exits '" + other.getName( ) + "' and '" + exit.getName( ) + "' in room '" + \
+                                         exit.orig( ) + "' are both called '" + alias + "'." ]
+
+        roots = project.hubs( )
+        reachable = self.reachable( roots )
+
+        # There can be thousands, in a random maze; only the first few are named.
+        unreachable = [ roomID for roomID in rooms if roomID not in reachable and roomID != "_environment" ]
+        where = " or ".join( "'" + root + "'" for root in roots ) or "anywhere"
+
+        if len( unreachable ) == 1:
+            self.warnings += [ "Room '" + unreachable[0] + "' can't be reached from " + where + "." ]
+
+        elif unreachable:
+            self.warnings += [ str( len( unreachable ) ) + " rooms can't be reached from " + where + ": " + \
+                               ", ".join( "'" + roomID + "'" for roomID in unreachable[ 0:5 ] ) + \
+                               ( " and " + str( len( unreachable ) - 5 ) + " more." if len( unreachable ) > 5 else "." ) ]
+
+    def outgoing ( self, roomID ):
+
+        """List of the exits leading out of the room 'roomID'."""
+
+        room = self._project.room( roomID )
+
+        return room.exits( ) if room else [ ]
+
+    def incoming ( self, roomID ):
+
+        """List of the exits leading into the room 'roomID'."""
+
+        return [ exit for origin in self._origins.get( roomID, [ ] )
+                 for exit in self._project.room( origin ).exits( ) if exit.dest( ) == roomID ]
+
+    def reachable ( self, roomIDs, hops = None ):
+
+        """Return the set of IDs of the rooms that can be reached from any of the rooms in
+        'roomIDs' (including those) by going through at most 'hops' exits, or any number if 'hops'
+        is None."""
+
+        found = set( roomID for roomID in roomIDs if roomID in self._project._rooms )
+        frontier = list( found )
+
+        while frontier and ( hops is None or hops > 0 ):
+
+            following = [ ]
+
+            for roomID in frontier:
+                for dest in self._destinations.get( roomID, [ ] ):
+
+                    if dest not in found and dest in self._project._rooms:
+                        found.add( dest )
+                        following += [ dest ]
+
+            frontier = following
+
+            if hops is not None:
+                hops -= 1
+
+        return found
+
+class RoomStore ( collections.abc.MutableMapping ):
+
+    """A dictionary of room IDs to Rooms, in the order they were added (like a Project's own), that
+    keeps the rooms in an SQLite database file instead of in memory, for projects too big for
+    that. Only the 'cacheSize' rooms used most recently are kept in memory; the rest are written
+    to the file, and read back as they're needed. The file is 'filename', which is emptied first,
+    or, by default, a temporary file that goes away by itself.
+
+    Like the shelve module's, rooms read back are new objects, and changing one doesn't change
+    what's in the file: it has to be stored again (store[ roomID ] = room) straight after, while
+    it's still the one in memory. (Exits are kept with their rooms, and read back with them. Any
+    changes to them that aren't stored are only lost, like the default messages Link.sge( ) fills
+    in, which would only be made again the same way.)"""
+
+    def __init__ ( self, filename = "", cacheSize = 1000 ):
+
+        self._db = sqlite3.connect( filename )
+
+        # It's only scratch space: nothing's lost if it's left half-written.
+        self._db.execute( "PRAGMA journal_mode = OFF" )
+        self._db.execute( "PRAGMA synchronous = OFF" )
+        self._db.execute( "DROP TABLE IF EXISTS rooms" )
+        self._db.execute( "CREATE TABLE rooms ( id TEXT PRIMARY KEY, room BLOB )" )
+
+        self.cacheSize = cacheSize
+
+        # Every room's ID, in order; only these and the cached rooms are in memory.
+        self._ids = collections.OrderedDict( )
+
+        # Room ID -> ( Room, whether it has been stored since it was last written to the file. )
+        self._cache = collections.OrderedDict( )
+
+        self._project = None
+
+    def attach ( self, project ):
+
+        """Keep the rooms of 'project' (see Project.__init__( ).)"""
+
+        self._project = project
+
+    def _dump ( self, room ):
+
+        # The project the room and its exits belong to isn't written out with them, of course.
+        elements = [ room ] + room.exits( )
+
+        for elem in elements:
+            elem._project = None
+
+        try:
+            return pickle.dumps( room, pickle.HIGHEST_PROTOCOL )
+
+        finally:
+            for elem in elements:
+                elem._project = self._project
+
+    def _load ( self, data ):
+
+        room = pickle.loads( data )
+
+        for elem in [ room ] + room.exits( ):
+            elem._project = self._project
+
+        return room
+
+    def _write ( self, roomID, room ):
+
+        self._db.execute( "INSERT OR REPLACE INTO rooms VALUES ( ?, ? )", ( roomID, self._dump( room ) ) )
+
+    def _remember ( self, roomID, room, stored ):
+
+        self._cache[ roomID ] = ( room, stored )
+
+        while len( self._cache ) > self.cacheSize:
+
+            ( oldID, ( oldRoom, oldStored ) ) = self._cache.popitem( last = False )
+
+            if oldStored:
+                self._write( oldID, oldRoom )
+
+    def __getitem__ ( self, roomID ):
+
+        if roomID in self._cache:
+            self._cache.move_to_end( roomID )
+            return self._cache[ roomID ][0]
+
+        if roomID not in self._ids:
+            raise KeyError( roomID )
+
+        ( data, ) = self._db.execute( "SELECT room FROM rooms WHERE id = ?", ( roomID, ) ).fetchone( )
+        room = self._load( data )
+
+        self._remember( roomID, room, False )
+
+        return room
+
+    def __setitem__ ( self, roomID, room ):
+
+        self._ids[ roomID ] = None
+        self._cache.pop( roomID, None )
+        self._remember( roomID, room, True )
+
+    def __delitem__ ( self, roomID ):
+
+        del self._ids[ roomID ]
+        self._cache.pop( roomID, None )
+        self._db.execute( "DELETE FROM rooms WHERE id = ?", ( roomID, ) )
+
+    def __contains__ ( self, roomID ):
+
+        return roomID in self._ids
+
+    def __iter__ ( self ):
+
+        return iter( self._ids )
+
+    def __len__ ( self ):
+
+        return len( self._ids )
+
+    def move_to_end ( self, roomID, last = True ):
+
+        """Move the room 'roomID' to the end of the order, or the beginning if 'last' is false
+        (like OrderedDict.move_to_end( ).)"""
+
+        self._ids.move_to_end( roomID, last )
+
+    def flush ( self ):
+
+        """Write every room still only in memory to the file."""
+
+        for ( roomID, ( room, stored ) ) in self._cache.items( ):
+            if stored:
+                self._write( roomID, room )
+
+        self._cache.clear( )
+        self._db.commit( )
+
+    def close ( self ):
+
+        self.flush( )
+        self._db.close( )
+
+class Project:
+
+    def __init__ ( self, name, rooms = None ):
+
+        self.name = name
+
+        # Room ID -> Room, in the order they're built. Each room keeps its own exits. For projects
+        # too big to keep in memory, 'rooms' can be a RoomStore to keep them in instead.
+        self._rooms = { } if rooms is None else rooms
+
+        if rooms is not None:
+            rooms.attach( self )
+
+        self._buildPostscript  = [ ]
+        self._destroyPostscript = [ ]
+
+        # Properties moved onto the environment room by .hoistProps( ).
+        self._hoisted = { }
+
+        # See .index( ).
+        self._index = None
+
+        # Strings -> their compiled templates (see .template( )), the most recently used last.
+        self._templates = collections.OrderedDict( )
+        self.templateCacheSize = 1000
+
+        # Default exit messages already made (see Link.defaultMessage( ).)
+        self._messages = { }
+
+        # Registered name -> dbref, for the objects whose dbrefs are known; see .useDbrefs( ).
+        self._dbrefs = { }
+
+        # How many times post-processing last teleported into a room, and how many times it didn't
+        # need to thanks to the 'teleports' optimisation (see .postProcessSegments( ).)
+        self.moves = { "made": 0, "avoided": 0 }
+
+        # How many commands, and bytes, the 'coalesce' optimisation was last given and left (see
+        # .iterSegments( ).)
+        self.coalesced = { "before": [ 0, 0 ], "after": [ 0, 0 ] }
+
+        # True if only some of the project's rooms were read (see compileRooms( )), so that nothing
+        # but the operations they were read for should be done with it.
+        self.partial = False
+
+        self.config = {
+            "sge?": True,
+            "sge": {
+                "osucc": None,
+                "succ": None,
+                "odrop": None
+            }
+        }
+
+        # Just what .configure( ) was given, without the defaults above (see mergeProjects( ).)
+        self._configured = { }
+
+    def configure( self, key, val ):
+
+        mergeDict( { key: val }, self.config )
+        mergeDict( { key: val }, self._configured )
+
+    def useDbrefs ( self, dbrefs ):
+
+        """From now on, call the objects in the dictionary 'dbrefs' (of registered names, without
+        the $, to dbrefs like "#1234") by their dbrefs in commands, rather than have the MUCK look
+        up their registered names every time. The dictionary isn't copied, so anything added to it
+        later (e.g. by upload.py as objects are created) is used too."""
+
+        self._dbrefs = dbrefs
+
+    def ref ( self, regname ):
+
+        """Return what commands should call the object registered as 'regname' by: see
+        .useDbrefs( )."""
+
+        return self._dbrefs.get( regname ) or "$" + regname
+
+    def optimisations ( self ):
+
+        """Return the list of optimisations (see OPTIMISATIONS) turned on by the 'optimise' config
+        option: either a list of their names, or true for all of them."""
+
+        wanted = self.config.get( "optimise" ) or [ ]
+
+        if wanted == True:
+            return OPTIMISATIONS
+
+        if type( wanted ) == str:
+            wanted = [ wanted ]
+
+        for name in wanted:
+            if name not in OPTIMISATIONS:
+                raise Exception( "No such optimisation: '" + name + "'." )
+
+        return wanted
+
+    def template ( self, string ):
+
+        """Return the compiled template (see compileTemplate( )) of the string 'string', compiling
+        it only the first time: the same few commands and default exit messages are interpolated
+        for a great many objects. Only the 'templateCacheSize' used most recently are kept, as
+        most rooms' own POSTSCRIPT commands are only ever used once."""
+
+        templates = self._templates
+        template = templates.get( string )
+
+        if template is not None:
+            templates.move_to_end( string )
+            return template
+
+        template = templates[ string ] = compileTemplate( string )
+
+        if len( templates ) > self.templateCacheSize:
+            templates.popitem( last = False )
+
+        return template
+
+    def hubs ( self ):
+
+        """Return the IDs of the rooms everything else should be reachable from: those named in the
+        'hub' config option (a room or list of rooms), or else the first room in the project."""
+
+        hubs = self.config.get( "hub" )
+
+        if type( hubs ) == str:
+            return [ hubs ]
+
+        if hubs:
+            return hubs
+
+        return [ roomID for roomID in self._rooms if roomID != "_environment" ][ 0:1 ]
+
+    def index ( self ):
+
+        """Return a LinkIndex of the project, making it if need be. It's made again whenever
+        rooms or exits have been added since."""
+
+        if self._index is None:
+            self._index = LinkIndex( self )
+
+        return self._index
+
+    def validate ( self ):
+
+        """Check the whole project over in one go, returning a list of errors (exits leading from
+        or to rooms that don't exist, exits in the same room sharing a name) and a list of warnings
+        (rooms that can't be reached.)"""
+
+        index = self.index( )
+
+        return ( index.errors, index.warnings )
+
+    def check ( self ):
+
+        """Like .validate( ), but raise a ProjectError listing the errors if there are any, and
+        return only the warnings."""
+
+        ( errors, warnings ) = self.validate( )
+
+        if errors:
+            raise ProjectError( errors )
+
+        return warnings
+
+    def environment ( self ):
+
+        """Return the project's environment room (see .hoistProps( )), or None if there isn't
+        one."""
+
+        return self._rooms.get( "_environment" )
+
+    def hoistProps ( self, share = 0.5 ):
+
+        """Look for properties that every room has, with the same value in at least the fraction
+        'share' of them, and set those once on an 'environment' room created for the project, which
+        all the rooms are parented to, instead of on every room. (The MUCK looks for properties on a
+        room's environment when the room itself doesn't have them.) Rooms with a different value
+        keep their own. Rooms that move themselves somewhere else after they're built (see
+        Room.movesItself( )) would lose their parent, so they're left out, and keep all of theirs.
+        Returns the dictionary of properties hoisted."""
+
+        # Only their IDs are kept, so that rooms in a RoomStore needn't all be read in at once.
+        roomIDs = [ roomID for roomID in self._rooms
+                    if roomID != "_environment" and not self._rooms[ roomID ].movesItself( ) ]
+
+        if len( roomIDs ) < 2:
+            return { }
+
+        counts = { }
+        present = { }
+
+        for roomID in roomIDs:
+            for ( prop, val ) in self._rooms[ roomID ].props( ).items( ):
+
+                # Lists aren't hashable, but tuples of the same lines are.
+                key = ( prop, tuple( val ) if type( val ) == list else val )
+                counts[key] = counts.get( key, 0 ) + 1
+                present[prop] = present.get( prop, 0 ) + 1
+
+        best = { }
+
+        for ( ( prop, val ), count ) in counts.items( ):
+            if prop not in best or count > best[prop][1]:
+                best[prop] = ( val, count )
+
+        hoisted = { }
+
+        for ( prop, ( val, count ) ) in best.items( ):
+
+            # A room without the property at all would start inheriting it, so it has to be on
+            # every room.
+            if count < 2 or count < share * len( roomIDs ) or present[prop] < len( roomIDs ):
+                continue
+
+            hoisted[prop] = list( val ) if type( val ) == tuple else val
+
+        if not hoisted:
+            return { }
+
+        env = self.environment( ) or Room( "_environment", self )
+        env.setName( self.name + " Environment" )
+        env._props = dict( hoisted )
+
+        self._index = None
+
+        # The environment room has to be built before anything can be parented to it.
+        if isinstance( self._rooms, RoomStore ):
+            self._rooms[ "_environment" ] = env
+            self._rooms.move_to_end( "_environment", last = False )
+
+        else:
+            self._rooms = { "_environment": env, **{ k: v for ( k, v ) in self._rooms.items( ) if k != "_environment" } }
+
+        for roomID in roomIDs:
+
+            room = self._rooms[ roomID ]
+            room.setParent( "$" + env.regname( ) )
+
+            # (For a RoomStore.)
+            self._rooms[ roomID ] = room
+
+        self._hoisted = hoisted
+
+        return hoisted
+
+    def addUserCommand ( self, cmd, context = "BUILD" ):
+
+        if context == "BUILD":
+            self._buildPostscript += [ cmd ]
+            return cmd
+
+        if context == "DESTROY":
+            self._destroyPostscript += [ cmd ]
+            return cmd
+
+        raise Exception( "Weird context for commands: '" + context + "'." )
+
+    def applyProps ( self, props, room ):
+
+        """Apply the block of properties given ('props') to the room named in parameter
+        'room'. Parses all special properties such as 'NAME' and exits. 'props' itself is left
+        alone."""
+
+        self.applyLayer( self.resolveProps( props ), room )
+
+    def resolveProps ( self, props ):
+
+        """Parse a block of properties as given for a room in a project file, without applying it
+        to anything: return a 'layer' that .applyLayer( ) can then apply to as many rooms as need
+        it, without parsing the block again or copying it."""
+
+        layer = { "name": props.get( "NAME" ), "postscript": [ ], "links": [ ], "props": { } }
+
+        # Deal with 'user commands'.
+        for ( context, commands ) in props.get( "POSTSCRIPT", { } ).items( ):
+            for command in commands:
+                layer["postscript"] += [ ( context, command ) ]
+
+        # Deal with exits.
+        for (dest, keys) in props.get( "LINKS", { } ).items( ):
+            layer["links"] += [ self.resolveLink( dest, keys ) ]
+
+        # The remaining properties are ordinary properties.
+        for ( prop, val ) in props.items():
+
+            if prop not in [ "NAME", "POSTSCRIPT", "LINKS" ] and type ( val ) == str:
+                ( prop, val ) = parseProp( prop, val.rstrip () )
+                layer["props"][prop] = val
+
+        return layer
+
+    def resolveLink ( self, dest, keys ):
+
+        """Parse an exit as given in a room's LINKS in a project file: the room it leads to, 'dest',
+        and its properties, 'keys'. Returns the ( dest, name, postscript, props ) that .applyLayer( )
+        expects in a layer's "links"."""
+
+        # Sometimes, every now and then... (rather implausibly, the only reason I did was for a
+        # demonstration maze-y-thing) we might want to open two exits to the same room.  Of
+        # course we can't have two keys in a dictionary with the same value, and YAML just
+        # throws one of them out. So, I made another convention to remove underscores from the
+        # name before use, so we could have multiple unique keys leading to the same room.
+        dest = sys.intern( dest.replace("_", "") )
+
+        # If you don't actually care about setting exit messages just now, there should be a
+        # concise way to just make an exit, without subproperties.
+        if type( keys ) == str:
+            return ( dest, keys, [ ], { } )
+
+        # Otherwise, exits get their own properties, etc., like everything else.
+
+        postscript = [ ( context, command ) for ( context, commands ) in keys.get( "POSTSCRIPT", { } ).items( )
+                       for command in commands ]
+
+        return ( dest, keys.get( "NAME", "[G]eneric [E]xit;exit;ge" ), postscript,
+                 dict( parseProp( prop, keys[prop] ) for prop in keys if prop not in [ "NAME", "POSTSCRIPT" ] ) )
+
+    def applyLayer ( self, layer, room ):
+
+        """Apply a layer of properties made by .resolveProps( ) to the room named 'room'. Nothing in
+        the layer is modified, so the same layer can be applied to any number of rooms."""
+
+        if room == "_environment":
+            raise Exception( "A room can't be called '_environment': that's kept for the room the " + \
+                             "'hoist' optimisation makes (see Project.hoistProps( ).)" )
+
+        self._index = None
+
+        target = self._rooms[room] if room in self._rooms else Room ( room, self )
+
+        # Stored (again) before it's changed, rather than after, but nothing else is read in between,
+        # so for a RoomStore it's still the one in memory when it is.
+        self._rooms[room] = target
+
+        for ( context, command ) in layer["postscript"]:
+            target.addUserCommand( command, context )
+
+        if layer["name"] is not None:
+            target.setName ( layer["name"] )
+
+        for link in layer["links"]:
+            self.attachLink( target, link )
+
+        if not layer["props"]:
+            return
+
+        if not target._props:
+            # Rather than copying the layer's properties, put them 'underneath' the room's own;
+            # setting a property on the room afterwards only ever changes the room's own.
+            target._props = PropLayers( layer["props"] )
+
+        else:
+            target._props.update( layer["props"] )
+
+    def attachLink ( self, target, link ):
+
+        """Add the exit 'link', as made by .resolveLink( ), to the Room 'target', and return the
+        Link. (For a RoomStore, the room has to be stored again afterwards.)"""
+
+        ( dest, name, postscript, props ) = link
+
+        k = Link( target.getID( ), dest, self )
+
+        target.addExit( k )
+
+        k.setName( name )
+
+        for ( context, command ) in postscript:
+            k.addUserCommand( command, context )
+
+        if props:
+            k._props = PropLayers( props )
+
+        return k
+
+    def addRoom ( self, roomID, props = None, layers = ( ) ):
+
+        """Add the room 'roomID' to the project, and return the Room: 'props' is a block of
+        properties of the form a room has in a project file (NAME, LINKS, POSTSCRIPT and ordinary
+        properties), applied on top of each of 'layers' in turn (made by .resolveProps( ), e.g. from
+        an ALL block.) This, .addLink( ) and .streamSegments( ) build a project straight from a
+        program generating it, without writing it out to a YAML file and reading it back in."""
+
+        if roomID in self._rooms:
+            raise Exception( "Room '" + roomID + "' is defined more than once." )
+
+        for layer in layers:
+            self.applyLayer( layer, roomID )
+
+        if props is not None or not layers:
+            self.applyProps( props or { }, roomID )
+
+        return self._rooms[ roomID ]
+
+    def addLink ( self, orig, dest, keys = "[G]eneric [E]xit;exit;ge" ):
+
+        """Add an exit from the room 'orig', which must already be in the project, to the room
+        'dest' (which needn't be yet), and return the Link. 'keys' is either its name, or its
+        properties as an exit has them in a room's LINKS in a project file."""
+
+        self._index = None
+
+        target = self._rooms[ orig ]
+        k = self.attachLink( target, self.resolveLink( dest, keys ) )
+
+        # (For a RoomStore.)
+        self._rooms[ orig ] = target
+
+        return k
+
+    def elements ( self, targets = None, **closure ):
 
         """Return a list of elements (rooms and exits) matching 'targets': first all the rooms named
         in the list of targets, then all the exits attached to those rooms. If 'targets' is None,
-        will return everything."""
+        will return everything. See .iterElements( ) for the other options, which all the methods
+        taking 'targets' also accept."""
+
+        return list( self.iterElements( targets, **closure ) )
+
+    def iterElements ( self, targets = None, incoming = False, hops = 0, reachable = False, within = False ):
+
+        """Like .elements( ), but yields the elements one at a time instead of building a list of
+        the whole project first. The selection of rooms can be widened, see .selectRooms( ); if
+        'incoming' is true, the exits leading into the rooms from elsewhere are included too, and if
+        'within' is true, the exits leading out of the rooms to ones not selected are left out."""
+
+        if not targets:
+            yield from self._rooms.values( )
+
+            for room in self._rooms.values( ):
+                yield from room.exits( )
+
+            return
+
+        rooms = [ self._rooms[ target ] for target in self.selectRooms( targets, hops, reachable ) ]
+
+        yield from rooms
+
+        selected = set( room.getID( ) for room in rooms )
+
+        for room in rooms:
+
+            if within:
+                yield from ( exit for exit in room.exits( ) if exit.dest( ) in selected )
+
+            else:
+                yield from room.exits( )
+
+        if incoming:
+
+            for room in rooms:
+                for exit in self.index( ).incoming( room.getID( ) ):
+
+                    if exit.orig( ) not in selected:
+                        yield exit
+
+    def selectRooms ( self, targets, hops = 0, reachable = False, incoming = False, within = False ):
+
+        """Return the IDs of the rooms named in 'targets' (ignoring any that don't exist), followed
+        by those that can be reached from them through at most 'hops' exits, or through any number
+        if 'reachable' is true (so that e.g. building them all doesn't leave exits leading
+        nowhere.) 'incoming' and 'within' are accepted, and ignored, for the convenience of
+        .iterElements( )'s callers."""
+
+        selected = [ target for target in targets if target in self._rooms ]
+
+        if hops or reachable:
+
+            found = self.index( ).reachable( selected, None if reachable else hops )
+
+            selected += [ roomID for roomID in self._rooms if roomID in found and roomID not in selected ]
+
+        return selected
+
+    def iterSegments ( self, op, targets = None, manifest = None, **closure ):
+
+        """Yield the commands for the command line operation 'op' ("c", "u", "d", "p" or "i") on the
+        elements matching 'targets' as segments (see segment( )): one for each element created,
+        updated or destroyed, holding everything done to it, and one for each element's
+        post-processing commands. A segment with no commands is left out. 'manifest' is only
+        needed for "i"."""
+
+        if op == "c":
+            segments = self.createSegments( targets, **closure )
+
+        elif op == "u":
+            segments = self.updateSegments( targets, **closure )
+
+        elif op == "d":
+            segments = self.destroySegments( targets, **closure )
+
+        elif op == "p":
+            segments = self.postProcessSegments( targets, **closure )
+
+        elif op == "i":
+            segments = self.incrementalSegments( manifest, targets, **closure )
+
+        else:
+            raise Exception( "No commands to send for operation '" + op + "'." )
+
+        yield from self.optimiseSegments( segments )
+
+    def optimiseSegments ( self, segments ):
+
+        """Yield each of 'segments', with the optimisations that are done segment by segment (see
+        OPTIMISATIONS) applied, leaving out any left with no commands."""
+
+        coalescing = "coalesce" in self.optimisations( )
+        self.coalesced = { "before": [ 0, 0 ], "after": [ 0, 0 ] }
+
+        for seg in segments:
+
+            if coalescing:
+
+                self.coalesced["before"][0] += len( seg["commands"] )
+                self.coalesced["before"][1] += sum( len( command ) + 1 for command in seg["commands"] )
+
+                seg["commands"] = coalesce( seg["commands"] )
+
+                self.coalesced["after"][0] += len( seg["commands"] )
+                self.coalesced["after"][1] += sum( len( command ) + 1 for command in seg["commands"] )
+
+            if seg["commands"]:
+                yield seg
+
+    def toCreate ( self, targets = None, **closure ):
+
+        """Return list of the commands necessary to create and set up rooms and exits corresponding
+        to 'targets' or, if 'targets' is None or a false value, the entire project. (See .elements()
+        for what the targets are.)"""
+
+        return list( self.iterCreate( targets, **closure ) )
+
+    def iterCreate ( self, targets = None, **closure ):
+
+        """Generator version of .toCreate( ): commands are produced one element at a time, so the
+        first of them is available before the whole project has been walked."""
+
+        for seg in self.iterSegments( "c", targets, **closure ):
+            yield from seg["commands"]
+
+    def createSegments ( self, targets = None, **closure ):
+
+        """Segments (see .iterSegments( )) version of .iterCreate( ). Building an element again
+        would make a second copy of it, so those segments aren't idempotent; they can be undone by
+        removing the element. Unless told otherwise, when the selection is widened by a number of
+        hops, the exits from the rooms at its edge to the rooms beyond aren't built, as those rooms
+        aren't; they're left for when they are (e.g. by -i.)"""
+
+        if targets and closure.get( "hops" ) and closure.setdefault( "within", True ):
+
+            selected = set( self.selectRooms( targets, **closure ) )
+            left = sum( 1 for roomID in selected for exit in self._rooms[ roomID ].exits( ) if exit.dest( ) not in selected )
+
+            if left:
+                sys.stderr.write( "Warning: " + str( left ) + " exit(s) leading out of the rooms selected " + \
+                                  "to rooms that aren't being built are left out.\n" )
+
+        for elem in self.iterElements( targets, **closure ):
+            reg = elem.regname( )
+            yield segment( reg, elem.build( ), False, removeCommands( reg ) )
+
+        # We want to make sure we run user commands after /everything/ has been built.
+
+        yield from self.postProcessSegments( targets, **closure )
+
+        if not targets:
+            # Only run the general custom build commands if we're building everything.
+            yield segment( "POSTSCRIPT/" + self.name, self._buildPostscript, False )
+
+    def streamSegments ( self, rooms, layers = ( ) ):
+
+        """Add each room from the iterable 'rooms', ( roomID, props ) pairs, to the project as
+        .addRoom( roomID, props, layers ) does, and yield the segments building the whole project
+        (as .iterSegments( "c" ) would, once they'd all been added), so that generating a project
+        and building it is one pipeline: each room's are yielded as soon as it's been added. Its
+        exits, and everything after, only once they all have been, as the rooms the exits lead to
+        have to be built first. Optimisations done on the whole project (hoist) aren't."""
+
+        def segments ( ):
+
+            for ( roomID, props ) in rooms:
+
+                room = self.addRoom( roomID, props, layers )
+                reg = room.regname( )
+
+                yield segment( reg, room.build( ), False, removeCommands( reg ) )
+
+            for room in self._rooms.values( ):
+                for exit in room.exits( ):
+
+                    reg = exit.regname( )
+                    yield segment( reg, exit.build( ), False, removeCommands( reg ) )
+
+            yield from self.postProcessSegments( )
+            yield segment( "POSTSCRIPT/" + self.name, self._buildPostscript, False )
+
+        yield from self.optimiseSegments( segments( ) )
+
+    def streamCreate ( self, rooms, layers = ( ) ):
+
+        """Commands version of .streamSegments( )."""
+
+        for seg in self.streamSegments( rooms, layers ):
+            yield from seg["commands"]
+
+    def toUpdate ( self, targets = None, **closure ):
+
+        """Return list of the commands necessary to create and set up rooms and exits corresponding
+        to 'targets' or, if 'targets' is None or a false value, the entire project. (See .elements()
+        for what the targets are.)"""
+
+        return list( self.iterUpdate( targets, **closure ) )
+
+    def iterUpdate ( self, targets = None, **closure ):
+
+        """Generator version of .toUpdate( )."""
+
+        for seg in self.iterSegments( "u", targets, **closure ):
+            yield from seg["commands"]
+
+    def updateSegments ( self, targets = None, **closure ):
+
+        """Segments (see .iterSegments( )) version of .iterUpdate( )."""
+
+        for elem in self.iterElements( targets, **closure ):
+            yield segment( elem.regname( ), elem.realise( ) )
+
+    def toDestroy ( self, targets = None, **closure ):
+
+        """Return a list of MUCK commands necessary to recycle and unregister rooms and exits
+        corresponding to 'targets', or the entire project if no targets specified."""
+
+        return list( self.iterDestroy( targets, **closure ) )
+
+    def iterDestroy ( self, targets = None, **closure ):
+
+        """Generator version of .toDestroy( ). Unless told otherwise, exits leading into the rooms
+        being destroyed from other rooms are destroyed as well, so they aren't left dangling."""
+
+        for seg in self.iterSegments( "d", targets, **closure ):
+            yield from seg["commands"]
+
+    def destroySegments ( self, targets = None, **closure ):
+
+        """Segments (see .iterSegments( )) version of .iterDestroy( ). Recycling something that's
+        already gone does no harm, so those segments are idempotent."""
+
+        closure.setdefault( "incoming", True )
+
+        for elem in self.iterElements( targets, **closure ):
+            yield segment( elem.regname( ), elem.remove( ) )
+
+        for elem in self.iterElements( targets, **closure ):
+            yield segment( "POSTSCRIPT/" + elem.regname( ), elem.postProcess( "DESTROY" ), False )
+
+        if not targets:
+            yield segment( "POSTSCRIPT/" + self.name, self._destroyPostscript, False )
+
+    def toPostProcess ( self, targets = None, **closure ):
+
+        """Return a command-list necessary to run all of the user's custom commands specified in
+        POSTSCRIPT: directives. This is considered a separate operation because the effect of said
+        commands isn't really known ahead of time, and so guessing whether the user might want them
+        re-run, say, on .toUpdate( ), isn't necessarily the best idea."""
+
+        return list( self.iterPostProcess( targets, **closure ) )
+
+    def iterPostProcess ( self, targets = None, **closure ):
+
+        """Generator version of .toPostProcess( )."""
+
+        for seg in self.iterSegments( "p", targets, **closure ):
+            yield from seg["commands"]
+
+    def postProcessSegments ( self, targets = None, **closure ):
+
+        """Segments (see .iterSegments( )) version of .iterPostProcess( ). What the user's commands
+        do isn't known, so they're taken not to be idempotent, and to have no undo."""
+
+        yield from self.scheduledPostProcess( self.iterElements( targets, **closure ) )
+
+    def scheduledPostProcess ( self, elems ):
+
+        """Yield segments of the post-processing commands for each of 'elems'. Each room's have to
+        be run from inside it, so normally begin with a teleport there; with the 'teleports'
+        optimisation, that's left out for rooms whose commands can all be changed to run from
+        anywhere (see Room.relocatedPostscript( )), and those rooms are done first. Exits' commands
+        have no teleport of their own: they're run wherever the last room's left off, so with the
+        optimisation they stay after the rooms' they followed, and are given a teleport to that room
+        if it's no longer the last. How many teleports were made and avoided is kept in .moves."""
+
+        self.moves = { "made": 0, "avoided": 0 }
+
+        scheduling = "teleports" in self.optimisations( )
+
+        # ( element, its commands, the room they run in, for exits' ), in their original order.
+        located = [ ]
+        where = None
+
+        for elem in elems:
+
+            commands = elem.postProcess( )
+
+            if not commands:
+                continue
+
+            if type( elem ) == Room:
+
+                where = elem
+                relocated = elem.relocatedPostscript( ) if scheduling else None
+
+                if relocated is not None:
+                    commands = relocated
+                    self.moves["avoided"] += 1
+
+                elif scheduling:
+                    located += [ ( elem, commands, None ) ]
+                    continue
+
+                else:
+                    self.moves["made"] += 1
+
+            elif scheduling:
+                located += [ ( elem, commands, where ) ]
+                continue
+
+            yield segment( "POSTSCRIPT/" + elem.regname( ), commands, False )
+
+        here = None
+
+        for ( elem, commands, room ) in located:
+
+            if type( elem ) == Room:
+                here = elem
+                self.moves["made"] += 1
+
+            elif room is not None and room is not here:
+                commands = [ "@tel me=" + room.ref( ) ] + commands
+                here = room
+                self.moves["made"] += 1
+
+            yield segment( "POSTSCRIPT/" + elem.regname( ), commands, False )
+
+    def snapshot ( self, targets = None, **closure ):
+
+        """Return a dictionary of the .state( ) of every element matching 'targets' (see
+        .elements( )), keyed by registered name."""
+
+        return { elem.regname( ): elem.state( ) for elem in self.iterElements( targets, **closure ) }
+
+    def toIncremental ( self, manifest, targets = None, **closure ):
+
+        """Return a list of the commands needed to bring a MUCK built from the project as it is
+        recorded in 'manifest' (a dictionary like the one returned by .snapshot( ), normally read
+        back with loadManifest( )) up to date with the project as it is now. Only elements matching
+        'targets' are considered."""
+
+        return list( self.iterIncremental( manifest, targets, **closure ) )
+
+    def iterIncremental ( self, manifest, targets = None, **closure ):
+
+        """Generator version of .toIncremental( ). Elements that are new get built, elements that
+        have gone away get removed, and for the rest only the name and the properties that actually
+        changed are set again (see MuckObject.realise( ).)"""
+
+        for seg in self.iterSegments( "i", targets, manifest, **closure ):
+            yield from seg["commands"]
+
+    def incrementalSegments ( self, manifest, targets = None, **closure ):
+
+        """Segments (see .iterSegments( )) version of .iterIncremental( ). Each element's state is
+        only worked out as it's come to, rather than all of them first."""
+
+        built = [ ]
+
+        for elem in self.iterElements( targets, **closure ):
+
+            reg = elem.regname( )
+
+            if reg not in manifest:
+                built += [ elem ]
+                yield segment( reg, elem.build( ), False, removeCommands( reg ) )
+
+        # Only the last of any exits with the same registered name is in the manifest.
+        for elem in lastOfEach( self.iterElements( targets, **closure ) ):
+
+            reg = elem.regname( )
+            old = manifest.get( reg )
+
+            if old is None:
+                continue
+
+            current = elem.state( )
+
+            if old["hash"] == current["hash"]:
+                continue
+
+            k = [ ]
+
+            if old["name"] != current["name"]:
+                k += [ "@name " + self.ref( reg ) + "=" + current["name"] ]
+
+            if old.get( "parent", "" ) != current.get( "parent", "" ):
+                k += elem.reparent( )
+
+            yield segment( reg, k + elem.realise( old["props"] ) )
+
+        for reg in self.stale( manifest, targets, **closure ):
+            yield segment( reg, removeCommands( reg, self.ref( reg ) ) )
+
+        yield from self.scheduledPostProcess( built )
+
+    def stale ( self, manifest, targets = None, **closure ):
+
+        """Return the registered names of the elements in 'manifest' that no longer exist in the
+        project. If 'targets' is given, only elements belonging to those rooms (including rooms
+        that no longer exist themselves) are considered."""
+
+        current = { elem.regname( ) for elem in self.iterElements( ) }
+        k = [ ]
+
+        if targets:
+            targets = set( targets ) | set( self.selectRooms( targets, **closure ) )
+
+        for ( reg, state ) in manifest.items( ):
+
+            if reg in current:
+                continue
+
+            # If we're only looking at part of the project, only remove things that belonged to it.
+            if targets and reg.split( "/" )[-1] not in targets and state.get( "orig" ) not in targets:
+                continue
+
+            k += [ reg ]
+
+        return k
+
+    def recordManifest ( self, manifest, op, targets = None, **closure ):
+
+        """Update 'manifest' in place to reflect having run operation 'op' (one of the command line
+        operations: "c", "u", "i", "C" or "d") on the elements matching 'targets'. Each element's
+        state goes into it as it's worked out, so with a Manifest (see loadManifest( )) they're never
+        all in memory at once."""
+
+        if op == "d":
+            closure.setdefault( "incoming", True )
+
+            for elem in self.iterElements( targets, **closure ):
+                manifest.pop( elem.regname( ), None )
+
+            return manifest
+
+        if op == "C":
+            manifest.clear( )
+
+        # What was left out (see .createSegments( )) wasn't built.
+        if op == "c" and targets and closure.get( "hops" ):
+            closure.setdefault( "within", True )
+
+        if op == "i":
+            for reg in self.stale( manifest, targets, **closure ):
+                manifest.pop( reg )
+
+        for elem in self.iterElements( targets, **closure ):
+            manifest[ elem.regname( ) ] = elem.state( )
+
+        return manifest
+
+    def removeRoom ( self, roomID ):
+
+        """Remove the room 'roomID', and the exits leading from it, from the project (but not any
+        exits leading to it from elsewhere.)"""
+
+        if self._rooms.pop( roomID, None ) is not None:
+            self._index = None
+
+    def room ( self, name ):
+
+        if name in self._rooms:
+            return self._rooms[name]
+
+        return None
+
+
+# The libyaml-based loader is a great deal faster than the pure-Python one, on big files, but isn't
+# always compiled in.
+YamlLoader = getattr( yaml, "CSafeLoader", yaml.SafeLoader )
+
+class YamlDumper ( getattr( yaml, "CSafeDumper", yaml.SafeDumper ) ):
+
+    """The libyaml-based dumper, where there is one, for the same reason. It never writes anchors
+    and aliases (for things that appear more than once): writeProject( ) dumps a project a piece at
+    a time, and an anchor from one piece would clash with, or be missing from, the others."""
+
+    def ignore_aliases ( self, data ):
+        return True
+
+def writeProject ( fh, projectName, rooms, config = None, postscript = None, chunkSize = 1000 ):
+
+    """Write a project file to the file handle 'fh': the project 'projectName', with the
+    dictionaries 'config' and 'postscript' (of commands by context, as in a POSTSCRIPT block) if
+    given, and the rooms from the iterable 'rooms', ( roomID, props ) pairs in the form
+    .addRoom( ) takes them (an ALL block is just another.) The rooms are written 'chunkSize' at a
+    time, as they come, so a generator can write a project of any size without ever holding all of
+    it in memory. Returns the number of rooms written."""
+
+    def dump ( data ):
+        return yaml.dump( data, Dumper = YamlDumper, default_flow_style = False, sort_keys = False,
+                          allow_unicode = True )
+
+    fh.write( dump( { "projectName": projectName } ) )
+
+    if config:
+        fh.write( dump( { "config": config } ) )
+
+    if postscript:
+        fh.write( dump( { "POSTSCRIPT": postscript } ) )
+
+    count = 0
+    chunk = { }
+
+    def flush ( ):
+
+        # Each chunk is dumped as a mapping of its own, and indented to make it part of 'rooms'.
+        # (Empty lines are left empty, so as not to add spaces to any block scalar.)
+        fh.write( "".join( "  " + line if line != "\n" else line for line in dump( chunk ).splitlines( True ) ) )
+        chunk.clear( )
+
+    for ( roomID, props ) in rooms:
+
+        if not count:
+            fh.write( "rooms:\n" )
+
+        chunk[ roomID ] = props
+        count += 1
+
+        if len( chunk ) >= chunkSize:
+            flush( )
+
+    if chunk:
+        flush( )
+
+    if not count:
+        fh.write( "rooms: {}\n" )
+
+    return count
+
+def compileProject ( filename, useCache = True, stats = None ):
+
+    """Read the YAML file 'filename' and return the Project it describes. Unless 'useCache' is
+    false, the compiled Project is kept in a cache file next to the YAML file (see cacheFile( )),
+    and read back from there instead as long as the YAML file hasn't changed. How long each step
+    takes is recorded in 'stats', if given (see Stats.)"""
+
+    with timed( stats, "read" ):
+
+        with open ( filename, "rb" ) as yamlFile:
+            source = yamlFile.read( )
+
+        key = cacheKey( filename, source )
+
+    if useCache:
+
+        with timed( stats, "load cache" ):
+            project = loadCache( filename, key )
+
+        if project:
+            return project
+
+    with timed( stats, "parse" ):
+        parsed = yaml.load ( source, Loader = YamlLoader )
+
+    with timed( stats, "assemble" ):
+        project = assembleProject( parsed )
+
+    if useCache:
+        with timed( stats, "save cache" ):
+            saveCache( filename, key, project )
+
+    return project
+
+def projectFiles ( paths ):
+
+    """Return the list of project files named in 'paths', or found in it, for directories (in order
+    of their names.)"""
+
+    filenames = [ ]
+
+    for path in paths:
+
+        if os.path.isdir( path ):
+            filenames += [ os.path.join( path, name ) for name in sorted( os.listdir( path ) )
+                           if name.endswith( ".yaml" ) or name.endswith( ".yml" ) ]
+
+        else:
+            filenames += [ path ]
+
+    if not filenames:
+        raise Exception( "No project files found in: " + ", ".join( paths ) )
+
+    return filenames
+
+def compileProjects ( paths, workers = None, stats = None, store = None ):
+
+    """Compile every project file named in 'paths' -- or found in it, for directories -- and merge
+    them into a single Project, so that exits in one file can lead to rooms in another. The files
+    are compiled in parallel, by up to 'workers' processes (default: one per CPU), but the result is
+    always the same as compiling them one after the other in order; files found in a directory are
+    taken in order of their names. If 'stats' is given, how long it takes is recorded there: for a
+    single file step by step, otherwise as a whole.
+
+    If 'store' (a RoomStore) is given, the rooms are kept in that rather than in memory. Then the
+    files are compiled one after the other, straight into it, and never cached: a project kept in
+    a store can't be pickled."""
+
+    filenames = projectFiles( paths )
+
+    if store is not None:
+
+        project = Project( None, store )
+
+        for filename in filenames:
+
+            with timed( stats, "index" ):
+                index = loadIndex( filename )
+
+            with open ( filename, "rb" ) as yamlFile:
+
+                # Where the file can be indexed, it's read a room at a time, so that it needn't all
+                # be in memory at once either.
+                with timed( stats, "parse" ):
+
+                    if index is None:
+                        parsed = yaml.load ( yamlFile.read( ), Loader = YamlLoader )
+
+                    else:
+                        parsed = { key: readPlace( yamlFile, index, place ) for ( key, place ) in index["top"].items( ) }
+                        parsed["rooms"] = IndexedRooms( yamlFile, index )
+
+                # The first file names the project.
+                project.name = project.name or parsed["projectName"]
+
+                with timed( stats, "assemble" ):
+                    assembleProject( parsed, project )
+
+        return project
+
+    if len( filenames ) == 1:
+        return compileProject( filenames[0], stats = stats )
+
+    with timed( stats, "compile" ):
+        with concurrent.futures.ProcessPoolExecutor( workers ) as pool:
+            return mergeProjects( list( pool.map( compileProject, filenames ) ) )
+
+def mergeProjects ( projects ):
+
+    """Merge the list of Projects 'projects', which must all have the same name, into one. Rooms,
+    exits and custom commands are kept in the order given; configuration from later projects is
+    merged over that from earlier ones (only what each actually set, not the defaults, just as
+    assembleProject( ) merges files' config blocks.)"""
+
+    merged = Project( projects[0].name )
+
+    for project in projects:
+
+        if project.name != merged.name:
+            raise Exception( "Can't merge projects with different names: '" + merged.name + \
+                             "' and '" + project.name + "'." )
+
+        for ( key, val ) in project._configured.items( ):
+            merged.configure( key, val )
+
+        for ( roomID, room ) in project._rooms.items( ):
+
+            if roomID in merged._rooms:
+                raise Exception( "Room '" + roomID + "' is defined in more than one file." )
+
+            room._project = merged
+            merged._rooms[ roomID ] = room
+
+            for exit in room.exits( ):
+                exit._project = merged
+
+        merged._buildPostscript += project._buildPostscript
+        merged._destroyPostscript += project._destroyPostscript
+
+    return merged
+
+def assembleProject ( parsed, project = None ):
+
+    """Return the Project described by 'parsed', a dictionary of the form read from a project's
+    YAML file. If 'project' is given, what 'parsed' describes is added to that instead, as though
+    the files had been merged (see mergeProjects( ).)"""
+
+    # These properties are set on all the rooms first, but can be overridden when it
+    # comes time to set the room's own properties. They may be useful, for instance,
+    # when using list-based @descs, or some other sort of repetitive thing.
+
+    rooms = parsed["rooms"]
+
+    if project is None:
+        project = Project( parsed["projectName"] )
+
+    elif project.name != parsed["projectName"]:
+        raise Exception( "Can't merge projects with different names: '" + project.name + \
+                         "' and '" + parsed["projectName"] + "'." )
+
+    if "config" in parsed:
+
+        for key in parsed["config"]:
+            project.configure( key, parsed["config"][key] )
+
+    # The global properties are only parsed once, and then applied underneath every room's own.
+    our_globals = project.resolveProps( rooms.get( "ALL", { } ) )
+
+    for roomID in rooms.keys( ):
+
+        if roomID == "ALL":
+            continue
+
+        if roomID in project._rooms:
+            raise Exception( "Room '" + roomID + "' is defined in more than one file." )
+
+        project.addRoom( roomID, rooms[roomID], [ our_globals ] )
+
+    if "POSTSCRIPT" in parsed:
+
+        for ( context, commands ) in parsed[ "POSTSCRIPT" ].items( ):
+            for command in commands:
+                project.addUserCommand( command, context )
+
+    return project
+
+def cacheFile ( filename ):
+
+    """Name of the file the compiled form of the project in 'filename' is cached in."""
+
+    return filename + ".cache"
+
+def cacheKey ( filename, source ):
+
+    """Return what identifies a particular version of the YAML file 'filename', whose contents are
+    'source': its path, modification time and a hash of the contents. The modification time of this
+    program is included too, so that changing it invalidates everything it cached."""
+
+    return ( os.path.abspath( filename ),
+             os.path.getmtime( filename ),
+             hashlib.sha1( source ).hexdigest( ),
+             os.path.getmtime( __file__ ) )
+
+def loadCache ( filename, key ):
+
+    """Return the Project cached for 'filename' if it was cached under 'key', otherwise None."""
+
+    try:
+        with open( cacheFile( filename ), "rb" ) as fh:
+
+            # The key is pickled separately in front of the project, so that a stale cache can be
+            # recognised without unpickling the whole thing.
+            if pickle.load( fh ) != key:
+                return None
+
+            return pickle.load( fh )
+
+    except Exception:
+        # Missing, unreadable or outdated cache files are all just cache misses.
+        return None
+
+def saveCache ( filename, key, project ):
+
+    """Cache 'project', compiled from 'filename', under 'key'."""
+
+    try:
+        with open( cacheFile( filename ), "wb" ) as fh:
+            pickle.dump( key, fh, pickle.HIGHEST_PROTOCOL )
+            pickle.dump( project, fh, pickle.HIGHEST_PROTOCOL )
+
+    except OSError:
+        # Not being able to write the cache shouldn't stop anyone building anything.
+        pass
+
+def indexFile ( filename ):
+
+    """Name of the file the room index of 'filename' is kept in (see loadIndex( ).)"""
+
+    return filename + ".index"
+
+def indexKey ( filename ):
+
+    """Return what identifies a particular version of the YAML file 'filename' for its room index:
+    its path, size and modification time (not a hash, which would mean reading all of it), and the
+    modification time of this program."""
+
+    info = os.stat( filename )
+
+    return ( os.path.abspath( filename ), info.st_size, info.st_mtime_ns, os.path.getmtime( __file__ ) )
+
+def indexProject ( filename ):
+
+    """Return an index of where everything is in the project file 'filename', so that parts of it
+    can be read without parsing the rest (see readPlace( )): a dictionary with "rooms", mapping
+    each room's ID to where its block is in the file, "all" likewise for the ALL block (or None),
+    "top" for everything else at the top level (projectName, config, POSTSCRIPT...), and "anchors"
+    for every node with a YAML anchor, which others may refer to with an alias. Each place is a
+    tuple of the byte offsets the block starts and ends at, the column it starts in, and the
+    anchors it refers to that aren't inside it. Returns None if the file can't be split up like
+    that: if it uses the same anchor twice, say, or isn't a project."""
+
+    with open( filename, "rb" ) as fh:
+        text = fh.read( ).decode( "utf-8" )
+
+    # The YAML events are only looked at for where they are; no Python objects are made for what's
+    # in them, which is most of the work of loading it.
+    events = yaml.parse( text, Loader = YamlLoader )
+
+    anchors = { }
+
+    def span ( event ):
+
+        """Return the place of the node 'event' begins, skipping the rest of it."""
+
+        # For each collection still open: where it started, its anchor, and the aliases used and
+        # anchors defined inside it so far.
+        unclosed = [ ]
+
+        while True:
+
+            if isinstance( event, ( yaml.MappingStartEvent, yaml.SequenceStartEvent ) ):
+                unclosed += [ ( event.start_mark, event.anchor, set( ), set( ) ) ]
+                event = next( events )
+                continue
+
+            if isinstance( event, ( yaml.MappingEndEvent, yaml.SequenceEndEvent ) ):
+                ( start, anchor, used, defined ) = unclosed.pop( )
+
+            elif isinstance( event, yaml.AliasEvent ):
+                ( start, anchor, used, defined ) = ( event.start_mark, None, { event.anchor }, set( ) )
+
+            else:
+                ( start, anchor, used, defined ) = ( event.start_mark, event.anchor, set( ), set( ) )
+
+            place = ( start.index, event.end_mark.index, start.column, tuple( sorted( used - defined ) ) )
+
+            if place[3] and start.column == 0:
+                raise ValueError( "aliases can only be followed in indented blocks" )
+
+            if anchor is not None:
+
+                if anchor in anchors:
+                    raise ValueError( "anchor '" + anchor + "' is used twice" )
+
+                anchors[ anchor ] = place
+                defined.add( anchor )
+
+            if not unclosed:
+                return place
+
+            unclosed[-1][2].update( used )
+            unclosed[-1][3].update( defined )
+
+            event = next( events )
+
+    def keys ( ):
+
+        """Yield the keys and places of the values of the mapping whose start was just read."""
+
+        for event in events:
+
+            if isinstance( event, yaml.MappingEndEvent ):
+                return
+
+            if not isinstance( event, yaml.ScalarEvent ) or event.anchor:
+                raise ValueError( "only plain keys can be indexed" )
+
+            value = next( events )
+
+            if event.value != "rooms":
+                yield ( event.value, span( value ) )
+
+            elif isinstance( value, yaml.MappingStartEvent ) and not value.anchor:
+                yield ( None, keys( ) )
+
+            else:
+                raise ValueError( "rooms must be a plain mapping" )
+
+    index = { "rooms": { }, "all": None, "top": { }, "anchors": anchors }
+
+    try:
+        for event in events:
+            if isinstance( event, yaml.MappingStartEvent ):
+                break
+
+        else:
+            return None
+
+        for ( key, value ) in keys( ):
+
+            if key is not None:
+                index["top"][ key ] = value
+                continue
+
+            for ( roomID, room ) in value:
+
+                if roomID == "ALL":
+                    index["all"] = room
+
+                else:
+                    index["rooms"][ roomID ] = room
+
+    except ValueError:
+        return None
+
+    if "projectName" not in index["top"]:
+        return None
+
+    if not text.isascii( ):
+
+        # The events count characters, not bytes; every offset needs converting.
+        places = [ index["all"] ] + [ place for key in [ "rooms", "top", "anchors" ] for place in index[ key ].values( ) ]
+        position = 0
+        size = 0
+        converted = { }
+
+        for offset in sorted( set( offset for place in places if place for offset in place[0:2] ) ):
+            size += len( text[ position:offset ].encode( "utf-8" ) )
+            position = offset
+            converted[ offset ] = size
+
+        def convert ( place ):
+            return place and ( converted[ place[0] ], converted[ place[1] ] ) + place[2:]
+
+        index = dict( { key: { name: convert( place ) for ( name, place ) in index[ key ].items( ) }
+                        for key in [ "rooms", "top", "anchors" ] }, all = convert( index["all"] ) )
+
+    return index
+
+def readPlace ( fh, index, place ):
+
+    """Read the node at 'place' (see indexProject( )) from the file handle 'fh', of the file
+    'index' was made of, along with any nodes it refers to by alias."""
+
+    def text ( place ):
+
+        ( start, end, column, _ ) = place
+        fh.seek( start )
+
+        # Indented as it was, so that a block spread over several lines still lines up.
+        return " " * column + fh.read( end - start ).decode( "utf-8" )
+
+    if not place[3]:
+        return yaml.load( text( place ), Loader = YamlLoader )
+
+    # The anchors referred to, and those they refer to in turn, are put in front of it in a list,
+    # in the order they were in the file, so that every alias follows its anchor again.
+    needed = set( )
+    following = list( place[3] )
+
+    while following:
+
+        anchor = following.pop( )
+
+        if anchor not in needed:
+            needed.add( anchor )
+            following += index["anchors"][ anchor ][3]
+
+    nodes = [ ]
+
+    for node in sorted( ( index["anchors"][ anchor ] for anchor in needed ), key = lambda place: place[0] ):
+
+        # An anchor inside another one comes with it.
+        if not nodes or node[1] > nodes[-1][1]:
+            nodes += [ node ]
+
+    return yaml.load( "".join( "-\n" + text( node ) + "\n" for node in nodes + [ place ] ), Loader = YamlLoader )[-1]
+
+class IndexedRooms ( collections.abc.Mapping ):
+
+    """The "rooms" of a project file, read one at a time as they're asked for, from the open file
+    'fh' of which 'index' was made (see indexProject( )), rather than all at once."""
+
+    def __init__ ( self, fh, index ):
+
+        self._fh = fh
+        self._index = index
+
+    def __getitem__ ( self, roomID ):
+
+        if roomID == "ALL" and self._index["all"]:
+            return readPlace( self._fh, self._index, self._index["all"] )
+
+        return readPlace( self._fh, self._index, self._index["rooms"][ roomID ] )
+
+    def __iter__ ( self ):
+
+        if self._index["all"]:
+            yield "ALL"
+
+        yield from self._index["rooms"]
+
+    def __len__ ( self ):
+
+        return len( self._index["rooms"] ) + bool( self._index["all"] )
+
+def loadIndex ( filename ):
+
+    """Return the index of 'filename' made by indexProject( ), or None if it hasn't got one. It's
+    kept in a file next to it (see indexFile( )), and only made again when 'filename' changes."""
+
+    key = indexKey( filename )
+
+    try:
+        with open( indexFile( filename ), "rb" ) as fh:
+
+            if pickle.load( fh ) == key:
+                return pickle.load( fh )
+
+    except Exception:
+        pass
+
+    index = indexProject( filename )
+
+    try:
+        with open( indexFile( filename ), "wb" ) as fh:
+            pickle.dump( key, fh, pickle.HIGHEST_PROTOCOL )
+            pickle.dump( index, fh, pickle.HIGHEST_PROTOCOL )
+
+    except OSError:
+        pass
+
+    return index
+
+def compileRooms ( filename, selections, stats = None ):
+
+    """Like compileProject( ), but only read the parts of 'filename' needed for the rooms
+    selected by 'selections', a list of ( targets, closure ) like parseOperation( ) returns: those
+    rooms (see Project.selectRooms( )) in full, and the rooms their exits lead to without their own
+    exits, which is all that building the exits needs. Everything else is skipped, so working on a
+    few rooms of a huge project doesn't mean parsing all of it (once it has been indexed; see
+    loadIndex( )). Returns None if that can't be done, and the whole project must be compiled
+    instead: if the file can't be indexed, or a selection includes the exits leading in from
+    elsewhere, which could be anywhere."""
+
+    if any( not targets or closure.get( "incoming" ) for ( targets, closure ) in selections ):
+        return None
+
+    with timed( stats, "index" ):
+        index = loadIndex( filename )
 
-        if not targets:
-            return [ self._rooms[ rn ] for rn in self._rooms.keys( ) ] + self._exits
+    if index is None:
+        return None
 
-        rooms = []
-        exits = []
+    places = index["rooms"]
 
-        for target in targets:
+    with open( filename, "rb" ) as fh:
 
-            if target in self._rooms:
-                rooms += [ self._rooms[ target ] ]
-                exits += self._rooms[ target ].exits( )
+        def read ( place ):
+            return readPlace( fh, index, place )
 
-        return rooms + exits
+        with timed( stats, "parse" ):
 
-    def toCreate ( self, targets = None ):
+            top = { key: read( place ) for ( key, place ) in index["top"].items( ) }
 
-        """Return list of the commands necessary to create and set up rooms and exits corresponding
-        to 'targets' or, if 'targets' is None or a false value, the entire project. (See .elements()
-        for what the targets are.)"""
+            project = Project( top["projectName"] )
 
-        k = []
+            for ( key, val ) in ( top.get( "config" ) or { } ).items( ):
+                project.configure( key, val )
 
-        for elem in self.elements( targets ):
-            k += elem.build( )
+            our_globals = project.resolveProps( read( index["all"] ) if index["all"] else { } )
+            layers = { }
 
-        # We want to make sure we run user commands after /everything/ has been built.
+            def layer ( roomID ):
 
-        for elem in self.elements( targets ):
-            k += elem.postProcess( )
+                if roomID not in layers:
+                    layers[ roomID ] = project.resolveProps( read( places[ roomID ] ) )
 
-        if not targets:
-            # Only run the general custom build commands if we're building everything.
-            k += self._buildPostscript
+                return layers[ roomID ]
 
-        return k
+            def destinations ( roomID ):
+                return [ link[0] for link in our_globals["links"] + layer( roomID )["links"] ]
 
-    def toUpdate ( self, targets = None ):
+            # The same search as LinkIndex.reachable( ), but reading rooms as it comes to them.
+            selected = set( )
 
-        """Return list of the commands necessary to create and set up rooms and exits corresponding
-        to 'targets' or, if 'targets' is None or a false value, the entire project. (See .elements()
-        for what the targets are.)"""
+            for ( targets, closure ) in selections:
 
-        k = [ ]
+                hops = None if closure.get( "reachable" ) else closure.get( "hops", 0 )
+                frontier = [ target for target in targets if target in places and target not in selected ]
+                selected.update( frontier )
 
-        for elem in self.elements( targets ):
-            k += elem.realise( )
+                while frontier and ( hops is None or hops > 0 ):
 
-        return k
+                    following = [ ]
 
-    def toDestroy ( self, targets = None ):
+                    for roomID in frontier:
+                        for dest in destinations( roomID ):
 
-        """Return a list of MUCK commands necessary to recycle and unregister rooms and exits
-        corresponding to 'targets', or the entire project if no targets specified."""
+                            if dest not in selected and dest in places:
+                                selected.add( dest )
+                                following += [ dest ]
 
-        k = [ ]
+                    frontier = following
 
-        for elem in self.elements( targets ):
-            k += elem.remove( )
+                    if hops is not None:
+                        hops -= 1
 
-        for elem in self.elements( targets ):
-            k += elem.postProcess( "DESTROY" )
+            needed = selected | set( dest for roomID in selected for dest in destinations( roomID ) if dest in places )
 
-        if not targets:
-            k += self._destroyPostscript
+            for roomID in needed:
+                layer( roomID )
 
-        return k
+    with timed( stats, "assemble" ):
 
-    def toPostProcess ( self, targets = None ):
+        # In the order they're in the file, just like the whole project would be.
+        for roomID in sorted( needed, key = lambda roomID: places[ roomID ][0] ):
 
-        """Return a command-list necessary to run all of the user's custom commands specified in
-        POSTSCRIPT: directives. This is considered a separate operation because the effect of said
-        commands isn't really known ahead of time, and so guessing whether the user might want them
-        re-run, say, on .toUpdate( ), isn't necessarily the best idea."""
+            if roomID in selected:
+                project.applyLayer( our_globals, roomID )
+                project.applyLayer( layer( roomID ), roomID )
 
-        k = [ ]
+            else:
+                project.applyLayer( dict( our_globals, links = [ ] ), roomID )
+                project.applyLayer( dict( layer( roomID ), links = [ ] ), roomID )
 
-        for elem in self.elements( targets ):
-            k += elem.postProcess( )
+        for ( context, commands ) in ( top.get( "POSTSCRIPT" ) or { } ).items( ):
+            for command in commands:
+                project.addUserCommand( command, context )
 
-        return k
+    project.partial = True
 
-    def room ( self, name ):
+    return project
 
-        if name in self._rooms:
-            return self._rooms[name]
+def writeCommands ( fh, commands, chunkSize = 1024 ):
 
-        return None
+    """Write the commands from the iterable 'commands' to the file handle 'fh', one per line (with
+    no newline after the last one, just like "\n".join( )). Lines are gathered into chunks of
+    'chunkSize' and written a chunk at a time, so a generator such as Project.iterCreate( ) can be
+    written out without ever holding all of its output in memory. Returns the number of commands
+    written."""
 
+    chunk = [ ]
+    count = 0
 
-def compileProject ( filename ):
+    for command in commands:
 
-    with open ( filename ) as yamlFile:
+        if count:
+            chunk += [ "\n" ]
 
-        parsed = yaml.load ( yamlFile )
+        chunk += [ command ]
+        count += 1
 
-        # These properties are set on all the rooms first, but can be overridden when it
-        # comes time to set the room's own properties. They may be useful, for instance,
-        # when using list-based @descs, or some other sort of repetitive thing.
+        if len( chunk ) >= chunkSize:
+            fh.write( "".join( chunk ) )
+            chunk = [ ]
 
-        rooms = parsed["rooms"].copy( )
+    fh.write( "".join( chunk ) )
 
-        our_globals = rooms.pop( "ALL", { } )
+    return count
 
-        project = Project( parsed["projectName"] )
+class Stats:
 
-        if "config" in parsed:
+    """Figures about a run, for finding out what's slow: how long each phase took, and how much
+    memory had been used by the end of it; how many rooms, exits and properties the project has;
+    and how many commands of each sort were produced (see .count( )), and how many bytes they come
+    to. If 'traceMemory', memory is measured with tracemalloc, which gives the most each phase
+    allocated at once, but slows everything down; otherwise it's the most memory the process has
+    used so far (if that can be found out.)"""
 
-            for key in parsed["config"]:
-                project.configure( key, parsed["config"][key] )
+    def __init__ ( self, traceMemory = False ):
 
-        for roomID in rooms.keys( ):
+        self.traceMemory = traceMemory
 
-            # In the process of room creation, values are actually removed from the set of
-            # properties being used. Normally this is not a problem, but in this case it can easily
-            # result in some of our 'global' properties -- notably POSTSCRIPT: -- being not so
-            # global. So, we make a copy for each invocation of applyProps( ). It has to be a "deep
-            # copy", as values are also removed from child dicts.
-            project.applyProps ( copy.deepcopy( our_globals ), roomID )
+        # [ name, seconds, bytes ], in the order they ran.
+        self.phases = [ ]
 
-            project.applyProps ( rooms[roomID], roomID )
+        self.project = { }
+        self.commands = { }
+        self.bytes = 0
 
-        if "POSTSCRIPT" in parsed:
+        if traceMemory:
+            tracemalloc.start( )
 
-            for ( context, commands ) in parsed[ "POSTSCRIPT" ].items( ):
-                for command in commands:
-                    project.addUserCommand( command, context )
+    @contextlib.contextmanager
+    def phase ( self, name ):
 
+        """Context manager: record how long what's run inside it takes, as the phase 'name'."""
 
-        return project
+        if self.traceMemory:
+            before = tracemalloc.get_traced_memory( )[0]
+            tracemalloc.reset_peak( )
+
+        started = time.perf_counter( )
+
+        try:
+            yield
+
+        finally:
+
+            if self.traceMemory:
+                used = tracemalloc.get_traced_memory( )[1] - before
+
+            elif resource:
+                # In kilobytes on Linux, but bytes on macOS.
+                used = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss * ( 1 if sys.platform == "darwin" else 1024 )
+
+            else:
+                used = None
+
+            self.phases += [ [ name, time.perf_counter( ) - started, used ] ]
+
+    def countProject ( self, project ):
+
+        """Record how many rooms, exits and properties (on all of them) 'project' has."""
+
+        self.project = { "rooms": len( project._rooms ),
+                         "exits": sum( len( room.exits( ) ) for room in project._rooms.values( ) ),
+                         "properties": sum( len( elem.props( ) ) for elem in project.iterElements( ) ) }
+
+    def count ( self, commands ):
+
+        """Yield the commands from the iterable 'commands', counting them by sort (their first
+        word: @dig, @set, lsedit and so on, or "(list lines)" for those in an lsedit session, or
+        "(other)") and adding up their length, with newlines."""
+
+        editing = False
+
+        for command in commands:
+
+            if editing:
+                kind = "(list lines)"
+                editing = command != ".end"
+
+            else:
+                kind = command.split( " ", 1 )[0]
+
+                if not kind.startswith( "@" ) and kind != "lsedit":
+                    kind = "(other)"
+
+                editing = kind == "lsedit"
+
+            self.commands[ kind ] = self.commands.get( kind, 0 ) + 1
+            self.bytes += len( command ) + 1
+
+            yield command
+
+    def report ( self ):
+
+        """Return everything recorded, as a plain (JSON-serialisable) dictionary."""
+
+        return { "phases": [ { "name": name, "seconds": seconds, "memory": used }
+                             for ( name, seconds, used ) in self.phases ],
+                 "memory": "traced peak" if self.traceMemory else "process peak",
+                 "project": self.project,
+                 "commands": self.commands,
+                 "bytes": self.bytes }
+
+    def format ( self ):
+
+        """Return everything recorded, as a table for people to read."""
+
+        k = [ "%-24s %10s %12s" % ( "Phase", "Seconds", "Memory (MB)" ) ]
+
+        for ( name, seconds, used ) in self.phases:
+            k += [ "%-24s %10.3f %12s" % ( name, seconds, "-" if used is None else "%.1f" % ( used / 1048576 ) ) ]
+
+        k += [ "", "(Memory is the " + self.report( )["memory"] + ".)", "" ]
+
+        if self.project:
+            k += [ "%(rooms)d rooms, %(exits)d exits, %(properties)d properties." % self.project ]
+
+        k += [ "%d commands, %d bytes:" % ( sum( self.commands.values( ) ), self.bytes ) ]
+
+        for kind in sorted( self.commands, key = lambda kind: -self.commands[ kind ] ):
+            k += [ "    %-20s %10d" % ( kind, self.commands[ kind ] ) ]
+
+        return "\n".join( k ) + "\n"
+
+def timed ( stats, name ):
+
+    """Return a context manager recording the phase 'name' in 'stats' (see Stats.phase( )), or doing
+    nothing if 'stats' is None."""
+
+    return stats.phase( name ) if stats else contextlib.nullcontext( )
+
+def counted ( stats, commands ):
+
+    """Return the iterable 'commands', counted by 'stats' (see Stats.count( )) if that isn't None."""
+
+    return stats.count( commands ) if stats else commands
+
+def prepareProject ( filenames, optimise = None, stats = None, operations = None, store = None ):
+
+    """Compile the project in 'filenames' (see compileProjects( )), apply any optimisations asked
+    for by 'optimise' (like the 'optimise' config option) or the project's own configuration, and
+    check it over, writing any warnings to standard error. Returns the Project ready to produce
+    commands from. If 'stats' is given, what it took, and what's in the project, are recorded
+    there.
+
+    If the project is only needed for 'operations', a list of operations as returned by
+    parseOperation( ), and they all target particular rooms of a single file, only those rooms are
+    read where possible (see compileRooms( )). Then only they are checked over, and only for errors:
+    whether every room can be reached depends on all the others. Otherwise, if 'store' (a
+    RoomStore) is given, the project's rooms are kept in that rather than in memory."""
+
+    project = None
+
+    if operations and len( projectFiles( filenames ) ) == 1:
+
+        # Destroying rooms means destroying the exits into them too (see .destroySegments( ).)
+        project = compileRooms( projectFiles( filenames )[0],
+                                [ ( targets, dict( closure, incoming = True ) if op == "d" else closure )
+                                  for ( op, targets, closure ) in operations ], stats )
+
+    if project is not None and optimise:
+        project.configure( "optimise", optimise )
+
+    # Hoisting properties depends on every room.
+    if project is None or "hoist" in project.optimisations( ):
+
+        project = compileProjects( filenames, stats = stats, store = store )
+
+        if optimise:
+            project.configure( "optimise", optimise )
+
+    if "hoist" in project.optimisations( ):
+        with timed( stats, "hoist" ):
+            project.hoistProps( )
+
+    # Find every problem with the project before producing anything.
+    with timed( stats, "check" ):
+
+        warnings = project.check( )
+
+        if not project.partial:
+            for warning in warnings:
+                sys.stderr.write( "Warning: " + warning + "\n" )
+
+    if stats:
+        stats.countProject( project )
+
+    return project
+
+class Watcher:
+
+    """Keeps a compiled Project up to date with the files it came from (see prepareProject( ),
+    which is given 'paths' and 'optimise'), for builders who change them often. Every time
+    .poll( ) finds a file has changed, only the rooms whose part of it changed are applied again;
+    anything else changing (the ALL block, config, POSTSCRIPT, which files there are, or anything
+    at all with the 'hoist' optimisation, which depends on every room) means compiling everything
+    again."""
+
+    def __init__ ( self, paths, optimise = None ):
+
+        self.paths = paths
+        self.optimise = optimise
+
+        self.project = None
+
+        # filename -> ( modification time, { roomID: hash of its YAML }, hash of everything else )
+        self._files = { }
+
+        # Rooms changed since the last time the project was found to be in working order.
+        self._pending = [ ]
+
+        self.recompile( )
+
+    def recompile ( self ):
+
+        """Compile everything again."""
+
+        self.project = prepareProject( self.paths, self.optimise )
+        self._files = { filename: self.summarise( filename )[0:3] for filename in projectFiles( self.paths ) }
+        self._pending = [ ]
+
+    def summarise ( self, filename ):
+
+        """Return what's kept in ._files for 'filename', followed by the file itself, parsed."""
+
+        mtime = os.path.getmtime( filename )
+
+        with open( filename, "rb" ) as fh:
+            parsed = yaml.load( fh.read( ), Loader = YamlLoader )
+
+        # (Or it's still being written.)
+        if type( parsed ) != dict:
+            raise Exception( filename + " is empty, or isn't a project." )
+
+        def digest ( data ):
+            return hashlib.sha1( json.dumps( data, sort_keys = True, default = str ).encode( ) ).hexdigest( )
+
+        rooms = dict( parsed.get( "rooms" ) or { } )
+        rest = { key: val for ( key, val ) in parsed.items( ) if key != "rooms" }
+        rest["ALL"] = rooms.pop( "ALL", None )
+
+        return ( mtime, { roomID: digest( room ) for ( roomID, room ) in rooms.items( ) }, digest( rest ), parsed )
+
+    def poll ( self ):
+
+        """Bring the project up to date with its files, if any have changed. Returns a list of the
+        IDs of the rooms that changed (including any that were added or removed) -- empty if
+        nothing did -- or None if everything was compiled again, so any of them might have. Raises
+        ProjectError if the files now describe a broken project (but keeps up with them anyway, so
+        once they're fixed the next .poll( ) carries on.)"""
+
+        filenames = projectFiles( self.paths )
+
+        if set( filenames ) != set( self._files ):
+            self.recompile( )
+            return None
+
+        for filename in filenames:
+
+            if os.path.getmtime( filename ) == self._files[ filename ][0]:
+                continue
+
+            ( mtime, rooms, rest, parsed ) = self.summarise( filename )
+            ( _, oldRooms, oldRest ) = self._files[ filename ]
+
+            if rest != oldRest or "hoist" in self.project.optimisations( ):
+                self.recompile( )
+                return None
+
+            self._files[ filename ] = ( mtime, rooms, rest )
+
+            ours = [ roomID for roomID in set( rooms ) | set( oldRooms ) if rooms.get( roomID ) != oldRooms.get( roomID ) ]
+            layer = self.project.resolveProps( parsed["rooms"].get( "ALL", { } ) )
+
+            for roomID in ours:
+
+                self.project.removeRoom( roomID )
+
+                if roomID in rooms:
+                    self.project.applyLayer( layer, roomID )
+                    self.project.applyProps( parsed["rooms"][ roomID ], roomID )
+
+            self._pending += [ roomID for roomID in ours if roomID not in self._pending ]
+
+        if not self._pending:
+            return [ ]
+
+        for warning in self.project.check( ):
+            sys.stderr.write( "Warning: " + warning + "\n" )
+
+        ( changed, self._pending ) = ( self._pending, [ ] )
+
+        return changed
+
+def watchProject ( watcher, manifest, send, interval = 1.0 ):
+
+    """Keep the MUCK up to date with the files 'watcher' (a Watcher) is watching, until
+    interrupted. First, and then every time anything changes (checking every 'interval' seconds),
+    the segments of commands needed to bring what's recorded in 'manifest' up to date (see
+    Project.iterSegments( ), operation "i") are passed to send( project, segments ), which should
+    get them run; then 'manifest' is updated, and saved. Problems with the files are written to
+    standard error (once each), and are waited out."""
 
-def saveProject ( project ):
+    changed = None
+    problem = None
 
-    """Write build instructions for project 'project' to text files in current directory."""
+    try:
+        while True:
+
+            if changed != [ ]:
+                project = watcher.project
+
+                # The exits leading into the rooms that changed are looked at too: their default
+                # messages (see Link.sge( )) may name them.
+                send( project, project.iterSegments( "i", changed, manifest, incoming = True ) )
+
+                project.recordManifest( manifest, "i", changed, incoming = True )
+                saveManifest( project, manifest )
+
+            time.sleep( interval )
+
+            try:
+                changed = watcher.poll( )
+                problem = None
+
+            except Exception as e:
+
+                if str( e ) != problem:
+                    sys.stderr.write( "Waiting for this to be fixed: " + str( e ) + "\n" )
+                    problem = str( e )
+
+                changed = [ ]
+
+    except KeyboardInterrupt:
+        pass
+
+def parseOperation ( opt ):
+
+    """Parse one of the command line's operations, e.g. '-c' or '-u2+:room,room2' (see the usage
+    message), into a tuple of: the operation's letter, the list of rooms it targets (or None for
+    the whole project), and a dictionary of keyword arguments to widen that selection with (see
+    Project.iterElements( ).)"""
+
+    match = re.match( "^-([cdupCi])([0-9]+|\\*)?(\\+)?(:(.*))?$", opt )
+
+    if not match:
+        raise Exception( "Don't understand the option '" + opt + "'." )
+
+    ( opt, widen, incoming, _, targets ) = match.groups( )
+
+    if targets:
+        targets = targets.split( "," )
+
+    closure = { }
+
+    if widen == "*":
+        closure["reachable"] = True
+
+    elif widen:
+        closure["hops"] = int( widen )
+
+    if incoming:
+        closure["incoming"] = True
+
+    return ( opt, targets or None, closure )
+
+def operationCommands ( project, manifest, op, targets = None, closure = { } ):
+
+    """Return an iterator over the commands for the command line operation 'op' ("c", "d", "u", "p"
+    or "i") on 'project' -- see parseOperation( ). 'manifest' is only needed for "i"."""
+
+    for seg in project.iterSegments( op, targets, manifest, **closure ):
+        yield from seg["commands"]
+
+def writeSegments ( fh, segments ):
+
+    """Write the segments from the iterable 'segments' (see Project.iterSegments( )) to the file
+    handle 'fh' as JSON, one per line, numbering them from 0. Returns how many were written."""
+
+    count = 0
+
+    for seg in segments:
+        fh.write( json.dumps( dict( seg, number = count ) ) + "\n" )
+        count += 1
+
+    return count
+
+def readSegments ( filename ):
+
+    """Yield the segments written to the file 'filename' by writeSegments( ), in order."""
+
+    with open( filename ) as fh:
+        for line in fh:
+            if line.strip( ):
+                yield json.loads( line )
+
+def reportOptimisations ( project, fh = sys.stderr ):
+
+    """Write to 'fh' what the optimisations turned on for 'project' saved in the operation it last
+    produced commands for."""
+
+    if "teleports" in project.optimisations( ) and sum( project.moves.values( ) ):
+        fh.write( "Post-processing: %d teleports made, %d avoided.\n" % \
+                  ( project.moves["made"], project.moves["avoided"] ) )
+
+    if "coalesce" in project.optimisations( ) and project.coalesced["before"][0]:
+        fh.write( "Coalescing: %d commands (%d bytes) down to %d (%d bytes.)\n" % \
+                  tuple( project.coalesced["before"] + project.coalesced["after"] ) )
+
+class Manifest ( collections.abc.MutableMapping ):
+
+    """A dictionary of registered names to the states of the elements built (as in
+    Project.snapshot( )), kept in the SQLite database file 'filename', so that only the elements
+    looked at or changed are ever read or written: a run that works on a few rooms of a huge
+    project doesn't pay for the rest. Changes are only kept once .save( ) is called."""
+
+    class Items ( collections.abc.ItemsView ):
+
+        # In one query, rather than one for each element.
+        def __iter__ ( self ):
+
+            for ( reg, state ) in self._mapping._db.execute( "SELECT reg, state FROM elements" ):
+                yield ( reg, json.loads( state ) )
+
+    def __init__ ( self, filename ):
+
+        self._db = sqlite3.connect( filename )
+        self._db.execute( "CREATE TABLE IF NOT EXISTS elements ( reg TEXT PRIMARY KEY, state TEXT )" )
+
+    def __getitem__ ( self, reg ):
+
+        row = self._db.execute( "SELECT state FROM elements WHERE reg = ?", ( reg, ) ).fetchone( )
+
+        if row is None:
+            raise KeyError( reg )
+
+        return json.loads( row[0] )
+
+    def __setitem__ ( self, reg, state ):
+
+        self._db.execute( "INSERT OR REPLACE INTO elements VALUES ( ?, ? )",
+                          ( reg, json.dumps( state, separators = ( ",", ":" ) ) ) )
+
+    def __delitem__ ( self, reg ):
+
+        if not self._db.execute( "DELETE FROM elements WHERE reg = ?", ( reg, ) ).rowcount:
+            raise KeyError( reg )
+
+    def __contains__ ( self, reg ):
+
+        return self._db.execute( "SELECT 1 FROM elements WHERE reg = ?", ( reg, ) ).fetchone( ) is not None
+
+    def __iter__ ( self ):
+
+        return ( reg for ( reg, ) in self._db.execute( "SELECT reg FROM elements" ) )
+
+    def __len__ ( self ):
+
+        return self._db.execute( "SELECT COUNT(*) FROM elements" ).fetchone( )[0]
+
+    def items ( self ):
+
+        return Manifest.Items( self )
+
+    def clear ( self ):
+
+        self._db.execute( "DELETE FROM elements" )
+
+    def save ( self ):
+
+        self._db.commit( )
+
+    def close ( self ):
+
+        self._db.close( )
+
+def manifestFile ( project ):
+
+    """Name of the file the manifest for 'project' is kept in."""
+
+    return project.name + "-manifest.db"
+
+def loadManifest ( project ):
+
+    """Open the manifest last saved for 'project' by saveManifest( ): a Manifest of element states
+    as returned by Project.snapshot( ). If there is no manifest yet, it's empty (so everything
+    looks new), unless there's one left in the JSON file earlier versions kept it in, which is
+    read in."""
+
+    filename = manifestFile( project )
+    old = project.name + "-manifest.json"
+    new = not os.path.exists( filename )
+
+    manifest = Manifest( filename )
+
+    if new and os.path.exists( old ):
+
+        with open( old ) as fh:
+            manifest.update( json.load( fh )[ "elements" ] )
+
+        manifest.save( )
+
+    return manifest
+
+def saveManifest ( project, manifest ):
+
+    """Keep the changes made to 'manifest' (see loadManifest( )) in the manifest file for
+    'project'."""
+
+    manifest.save( )
+
+def dbrefsFile ( project ):
+
+    """Name of the file the dbrefs of the objects built for 'project' are kept in."""
+
+    return project.name + "-dbrefs.json"
+
+def loadDbrefs ( project ):
+
+    """Read back the dbrefs last written for 'project' by saveDbrefs( ): a dictionary of registered
+    names to dbrefs (see Project.useDbrefs( )), or an empty one if there are none yet."""
+
+    if not os.path.exists( dbrefsFile( project ) ):
+        return { }
+
+    with open( dbrefsFile( project ) ) as fh:
+        return json.load( fh )[ "dbrefs" ]
+
+def saveDbrefs ( project, dbrefs ):
+
+    """Write 'dbrefs' (see loadDbrefs( )) to the dbrefs file for 'project'."""
+
+    with open( dbrefsFile( project ), "w" ) as fh:
+        json.dump( { "project": project.name, "dbrefs": dbrefs }, fh, indent = 1, sort_keys = True )
+
+def saveProject ( project, stats = None ):
+
+    """Write build instructions for project 'project' to text files in current directory. If
+    'stats' is given, the commands written to the text files are counted there."""
 
     # Of course, this might fail. But it seems unlikely. And hopefully the users will be
     # able to figure out what went wrong from the exception ... there probably SHOULD still
@@ -569,32 +3321,50 @@ def saveProject ( project ):
 
     with open( project.name + "-build.txt", "w" ) as fh:
 
-        fh.write( "\n".join( project.toCreate( None ) ) )
+        writeCommands( fh, counted( stats, project.iterCreate( None ) ) )
         fh.write( "\n\n" )
-        fh.write( "\n".join( project.toPostProcess( None ) ) )
+        writeCommands( fh, counted( stats, project.iterPostProcess( None ) ) )
 
     with open( project.name + "-destroy.txt", "w" ) as fh:
 
-        fh.write( "\n".join( project.toDestroy( None ) ) )
+        writeCommands( fh, counted( stats, project.iterDestroy( None ) ) )
+
+    # The same again, but in segments, for upload.py to send and pick up where it left off if
+    # anything goes wrong.
+
+    with open( project.name + "-build.jsonl", "w" ) as fh:
+        writeSegments( fh, project.iterSegments( "c" ) )
+
+    with open( project.name + "-destroy.jsonl", "w" ) as fh:
+        writeSegments( fh, project.iterSegments( "d" ) )
 
     print( "Files written (probably.)" )
 
 
 if __name__ == "__main__":
 
-    filename = None
+    filenames = [ ]
     opts = [ ]
+    optimise = None
+    segments = False
+    dbrefs = False
+    stats = None
+    profiler = None
+    watch = None
+    store = None
 
     if len( sys.argv ) <= 1:
         print ( """Usage:
 
-python muckBuilder.py [-o[:room,room2,...]] [-o[:room,room2,...]] \\
-    filename.yaml
+python muckBuilder.py [-o[:room,room2,...]] [-o[:room,room2,...]] [--segments] [--dbrefs] \\
+    [--stats[=memory]] [--profile=filename] [-w[seconds]] [--store[=filename]] \\
+    filename.yaml [filename2.yaml directory ...]
 
      ... where -o[:room,room2,...] is one of the following options/operations:
 
 -d produces commands that can be used to un-build the entire project or the
-given selection of rooms and their attached exits;
+given selection of rooms and their attached exits (including exits from other
+rooms that lead to them);
 
 -c produces commands that can be used to build the entire project or the given
 selection of rooms (though if they have exits that wish to be linked to other
@@ -609,57 +3379,207 @@ or for the entire project, not creating or deleting anything;
 that can be used to destroy it, writing them to files with names derived from
 the projectName; if no other operation / option is given, -C is the default.
 
+-i produces only the commands needed to bring the rooms built last time up to
+date: new rooms and exits are built, ones that have gone away are removed, and
+only properties that actually changed are set again. What was built last time is
+read from the manifest file (projectName-manifest.db), which every -c, -u, -d,
+-i and -C run updates.
+
+A selection of rooms can be widened by putting one of these straight after the
+operation's letter (before the :):
+
+    a number N, to include every room within N exits of the selected rooms;
+
+    *, to include every room that can be reached from the selected rooms at all;
+
+    +, to include the exits from other rooms that lead into the selected rooms.
+
+For instance, -c*:hub builds the hub and everything that can be reached from it,
+so no exit is left leading to a room that wasn't built, and -u2+:hub updates the
+hub, the rooms up to two exits away and all the exits into any of them. -c with
+a number leaves out the exits from the furthest rooms to the ones beyond (with
+a warning), as those aren't built; -i builds them once they are.
+
+If there's a single file, and every operation has a selection of rooms (without
++, and not -d, which always includes the exits into them), only the rooms
+selected and the rooms their exits lead to are read from it, so working on a
+few rooms of even a huge project is quick. The file is indexed for this the
+first time, which takes a while if it's big; the index is kept in a file named
+after it, ending in .index. Only the rooms read are checked over, so there are
+no warnings about rooms that can't be reached.
+
+-O[:optimisation,...] turns on the given optimisations (or all of them) for
+whatever operations are requested, as though they had been listed in the
+'optimise' config option. They are:
+
+    hoist: properties every room has, mostly with the same value, are set once
+    on an environment room made for the project, and every room is parented to
+    it (so inherits them), rather than being set on every room.
+
+    teleports: rooms' POSTSCRIPT commands that only change the room itself
+    (like @set here=D) are given the room instead of 'here', so they can be
+    run without teleporting there first; they're run first, and rooms whose
+    commands do need a teleport after, with exits' commands still run from
+    the room they'd otherwise have been. How many teleports were saved is
+    written to standard error.
+
+    coalesce: property and flag settings that would be overwritten straight
+    away by another of the same property are left out, and each is given in
+    its shortest form (e.g. @succ rather than setting _/sc.) How many commands
+    and bytes are left is written to standard error. This is done separately
+    for each room and exit, so upload.py can still resume partway through.
+
 If you request multiple operations you will receive the results of those
 operations in order without any particular separator. Everything is written to
 standard output.
 
+--segments writes each operation's commands as JSON, one line for each segment:
+the commands for one room or exit, or one set of POSTSCRIPT commands, saying
+whether running them twice is safe and how to undo them if not. upload.py can
+send these and resume partway through. -C writes them too, to files named like
+its other ones, ending in -build.jsonl and -destroy.jsonl.
+
+--dbrefs refers to objects by their dbrefs (#1234), rather than their registered
+names, wherever they are known. They're read from projectName-dbrefs.json, which
+upload.py --dbrefs fills in as it builds things. This saves the MUCK looking up
+every name, but the file must be kept up to date: anything recycled other than
+by upload.py --dbrefs has to be removed from it by hand.
+
+If several files (or directories, meaning all the .yaml files in them) are given,
+they are compiled in parallel and treated as one project, so exits can lead from
+rooms in one file to rooms in another. They must all have the same projectName.
+
+-w watches the files, and keeps the rooms built last time up to date with them
+until interrupted: first it produces the commands -i would, then, every time a
+file changes (it checks every second, or as often as given), the commands to
+bring just the rooms that changed (and their exits) up to date. Other operations
+are ignored. upload.py -w sends the commands straight to the MUCK instead.
+
+--store keeps the rooms in an SQLite database file, rather than in memory, for
+projects too big for that; only the rooms used most recently are kept in memory
+as well. Everything takes longer. The file is a temporary one unless a filename
+is given, in which case anything already in it is thrown away first. Files that
+can be indexed (see above) are also read a room at a time.
+
+--stats writes to standard error, at the end, how long each phase took (reading,
+parsing and assembling the project, checking it, and each operation), the most
+memory used by then, how big the project is, and how many of each command were
+produced; --stats=memory measures how much memory each phase itself used, but
+makes everything slower. --profile=filename profiles everything with cProfile,
+and writes the results to filename, to be read with pstats (or e.g. snakeviz.)
+
 """ )
         quit ( )
 
     for arg in sys.argv[1:]:
 
-        if not re.match( "^-[cdupC]", arg ):
+        if re.match( "^-O", arg ):
+            optimise = arg[3:].split( "," ) if arg[2:3] == ":" else True
 
-            # It's probably a filename.
-            if not filename:
-                filename = arg
+        elif arg == "--segments":
+            segments = True
 
-            else:
-                raise Exception( "Not going to do more than one file at a time." )
-                # (That might be good to have later, though.)
+        elif arg == "--dbrefs":
+            dbrefs = True
+
+        elif arg in [ "--stats", "--stats=memory" ]:
+            stats = Stats( arg == "--stats=memory" )
+
+        elif re.match( "^-w([0-9.]+)?$", arg ):
+            watch = float( arg[2:] or 1 )
+
+        elif arg.startswith( "--profile=" ):
+            profiler = ( cProfile.Profile( ), arg[ len( "--profile=" ): ] )
+
+        elif re.match( "^--store(=.*)?$", arg ):
+            store = RoomStore( arg[ len( "--store=" ): ] )
+
+        elif not re.match( "^-[cdupCi]", arg ):
+
+            # It's probably a filename.
+            filenames += [ arg ]
 
         else:
             opts += [ arg ]
 
-    if not filename:
-        raise Exception( "No filename provided." )
+    # The store's file is only scratch space, but it's closed whatever happens, so that it's
+    # tidied up (or, if it was named, left complete.)
+    try:
+        if not filenames:
+            raise Exception( "No filename provided." )
+
+        # I'm not quite sure if this should actually BE the default. Oh well.
+
+        opts = opts or [ "-C" ]
+
+        if watch is not None:
+
+            def send ( project, segments ):
+
+                if dbrefs:
+                    project.useDbrefs( loadDbrefs( project ) )
+
+                for seg in segments:
+                    sys.stdout.write( "\n".join( seg["commands"] ) + "\n" )
+
+                sys.stdout.write( "\n" )
+                sys.stdout.flush( )
+
+                reportOptimisations( project )
+
+            watcher = Watcher( filenames, optimise )
+            watchProject( watcher, loadManifest( watcher.project ), send, watch )
+            quit ( )
+
+        if profiler:
+            profiler[0].enable( )
+
+        project = prepareProject( filenames, optimise, stats, [ parseOperation( opt ) for opt in opts ], store )
+
+        # Only -i reads the manifest, and only the operations that build or remove anything
+        # change it.
+        manifest = None
+
+        if any( opt[1] in "cduiC" for opt in opts ):
+            with timed( stats, "load manifest" ):
+                manifest = loadManifest( project )
+
+        if dbrefs:
+            project.useDbrefs( loadDbrefs( project ) )
 
-    # I'm not quite sure if this should actually BE the default. Oh well.
+        for opt in opts:
 
-    opts = opts or [ "-C" ]
+            ( opt, targets, closure ) = parseOperation( opt )
 
-    project = compileProject( filename )
+            with timed( stats, "-" + opt ):
 
-    for opt in opts:
+                if opt != "C" and segments:
+                    writeSegments( sys.stdout, project.iterSegments( opt, targets, manifest, **closure ) )
 
-        opt = opt[1:]               # Cuts off the leading - character.
+                elif opt != "C":
+                    writeCommands( sys.stdout, counted( stats, operationCommands( project, manifest, opt, targets, closure ) ) )
+                    sys.stdout.write( "\n\n" )
 
-        targets = None
+                if opt == "C":
+                    saveProject( project, stats )
 
-        if len( opt ) > 2 and opt[1] == ':':
-            targets = opt[ 2: ].split( "," )        # [2:] cuts off first 2 chars, i.e. /[cdu]:/
+            reportOptimisations( project )
 
-        if opt[0] == "c":
-            print ( "\n".join( project.toCreate( targets ) ) + "\n" )
+            if opt in "cduiC":
+                with timed( stats, "record manifest" ):
+                    project.recordManifest( manifest, opt, targets, **closure )
 
-        if opt[0] == "d":
-            print ( "\n".join( project.toDestroy( targets ) ) + "\n" )
+        if manifest is not None:
+            with timed( stats, "save manifest" ):
+                saveManifest( project, manifest )
 
-        if opt[0] == "u":
-            print ( "\n".join( project.toUpdate( targets ) ) + "\n" )
+        if profiler:
+            profiler[0].disable( )
+            profiler[0].dump_stats( profiler[1] )
 
-        if opt[0] == "p":
-            print ( "\n".join( project.toPostProcess( targets ) ) + "\n" )
+        if stats:
+            sys.stderr.write( stats.format( ) )
 
-        if opt[0] == "C":
-            saveProject( project )
+    finally:
+        if store is not None:
+            store.close( )
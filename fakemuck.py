@@ -0,0 +1,179 @@
+
+import sys # .argv
+import time
+import asyncio
+
+class FakeMuck:
+
+    """A very small stand-in for a MUCK server, for trying out upload.py without a real one. It
+    speaks just enough of the protocol: 'connect <player> <password>', OUTPUTPREFIX and
+    OUTPUTSUFFIX, QUIT, lsedit sessions, and the messages @dig and @action give. Every other command
+    is simply recorded. It can also pretend to have flood control, refusing commands sent too
+    quickly, or hang up partway through."""
+
+    def __init__ ( self, players = None, floodLimit = None, floodWindow = 1.0, dropAfter = None ):
+
+        self.players = players or { "builder": "password" }
+
+        # If floodLimit is set, then once more than that many commands arrive within floodWindow
+        # seconds, everything is refused until floodWindow seconds have gone by.
+        self.floodLimit = floodLimit
+        self.floodWindow = floodWindow
+
+        # If dropAfter is set, the connection is closed (once) as soon as that many commands have
+        # been carried out, without answering the last one.
+        self.dropAfter = dropAfter
+
+        # Every command that was actually carried out, in order, and every one that was refused.
+        self.log = [ ]
+        self.refused = [ ]
+
+        self._nextDbref = 100
+        self._server = None
+
+    async def start ( self, host = "127.0.0.1", port = 0 ):
+
+        """Start listening; returns the port (which is chosen by the system if 'port' is 0.)"""
+
+        self._server = await asyncio.start_server( self._serve, host, port )
+
+        return self._server.sockets[0].getsockname( )[1]
+
+    async def stop ( self ):
+
+        self._server.close( )
+        await self._server.wait_closed( )
+
+    async def _serve ( self, reader, writer ):
+
+        try:
+            await self._session( reader, writer )
+
+        except ( ConnectionError, asyncio.CancelledError ):
+            # The client went away, or we're being shut down.
+            pass
+
+        writer.close( )
+
+    async def _session ( self, reader, writer ):
+
+        player = None
+        prefix = None
+        suffix = None
+        editing = False
+        recent = [ ]
+        floodedUntil = 0
+
+        def send ( line ):
+            writer.write( ( line + "\r\n" ).encode( ) )
+
+        send( "Welcome to FakeMuck. Use 'connect <player> <password>' to log in." )
+
+        while True:
+
+            line = await reader.readline( )
+
+            if not line:
+                break
+
+            line = line.decode( ).rstrip( "\r\n" )
+
+            if line.startswith( "OUTPUTPREFIX " ):
+                prefix = line[ len( "OUTPUTPREFIX " ): ]
+                continue
+
+            if line.startswith( "OUTPUTSUFFIX " ):
+                suffix = line[ len( "OUTPUTSUFFIX " ): ]
+                continue
+
+            if line == "QUIT":
+                send( "Goodbye!" )
+                break
+
+            if not player:
+
+                words = line.split( )
+
+                if len( words ) == 3 and words[0] == "connect" and self.players.get( words[1] ) == words[2]:
+                    player = words[1]
+                    send( "*** Connected ***" )
+
+                else:
+                    send( "Either that player does not exist, or has a different password." )
+
+                continue
+
+            if prefix:
+                send( prefix )
+
+            now = time.monotonic( )
+            recent = [ t for t in recent if now - t < self.floodWindow ] + [ now ]
+
+            if self.floodLimit and len( recent ) > self.floodLimit:
+                floodedUntil = now + self.floodWindow
+
+            if now < floodedUntil:
+                self.refused += [ line ]
+                send( "You're sending commands too fast! Slow down." )
+
+            elif editing:
+                self.log += [ line ]
+
+                if line == ".end":
+                    editing = False
+                    send( "Editor exited." )
+
+            else:
+                self.log += [ line ]
+
+                if self.dropAfter and len( self.log ) >= self.dropAfter:
+                    self.dropAfter = None
+                    break
+
+                for output in self._execute( line ):
+                    send( output )
+
+                editing = line.startswith( "lsedit " )
+
+            if suffix:
+                send( suffix )
+
+            await writer.drain( )
+
+    def _execute ( self, line ):
+
+        """Return the output a MUCK would (roughly) give for the command 'line'."""
+
+        if line.startswith( "@dig " ):
+            self._nextDbref += 1
+            return [ "Room " + line[5:].split( "=" )[0] + " created with room number " + \
+                     str( self._nextDbref ) + "." ]
+
+        if line.startswith( "@action " ):
+            self._nextDbref += 1
+            return [ "Action created with number " + str( self._nextDbref ) + " and attached." ]
+
+        if line.startswith( "lsedit " ):
+            return [ "<    Welcome to the list editor.    >" ]
+
+        return [ ]
+
+
+if __name__ == "__main__":
+
+    # python fakemuck.py [port]
+    #
+    # Runs until interrupted, then prints every command it was sent.
+
+    muck = FakeMuck( )
+
+    async def main ( ):
+        port = await muck.start( port = int( sys.argv[1] ) if len( sys.argv ) > 1 else 4201 )
+        print( "FakeMuck listening on port " + str( port ) + "; log in as builder/password." )
+        await asyncio.Event( ).wait( )
+
+    try:
+        asyncio.run( main( ) )
+
+    except KeyboardInterrupt:
+        print( "\n".join( muck.log ) )
@@ -1,72 +1,197 @@
 
+import sys # .argv
+import os
 import random
+import collections
+import json
+import concurrent.futures
 
-import yaml
+import build
+import topology
 
 class Grammar:
 
-    """ A simpler version of Tracery's ideas. """
+    """ A simpler version of Tracery's ideas. Each template (and each of the rules' alternatives) is
+    compiled into a tuple of tokens the first time it's used: literal text, and ( rule, save ) for
+    each [rule] or [!rule] in it. """
 
-    def __init__( self, rules = None ):
+    def __init__( self, rules = None, rng = None ):
 
         self.rules = rules or { }
 
-        # To be pop()'d off by the caller.
+        # Anything with a .choice( ), e.g. a random.Random( seed ) for repeatable results.
+        self.rng = rng or random
+
+        # To be pop()'d off by the caller of .parse( ).
         self.saved = [ ]
 
-    def parse( self, string ):
+        # Template -> its tokens; rule -> its alternatives' tokens (or just the text, for those with
+        # no rules in them), and see ._choices( ).
+        self._compiled = { }
+        self._alternatives = { }
+
+    def compile( self, string ):
+
+        """ Return the tokens of the template 'string' (see above), compiling it if need be. """
+
+        if string in self._compiled:
+            return self._compiled[string]
+
+        tokens = [ ]
+        buffer = ''
+
+        brackets = False
+
+        for char in string:
+            if char == '[':
+                if brackets:
+                    raise Exception( "Grammar.parse: can't nest brackets" )
 
-        if "[" in string or "]" in string:
+                if buffer != '':
+                    tokens += [ buffer ]
 
-            fragments = [ ]
-            buffer = ''
+                buffer = ''
+                brackets = True
 
-            brackets = False
+            elif char == ']':
+                if not brackets:
+                    raise Exception( "Grammar.parse: unmatched bracket" )
 
-            for char in string:
-                if char == '[':
-                    fragments += [ buffer ]
+                brackets = False
+
+                # Mechanism for saving what result we got: put a ! somewhere in the [ ]-surrounded text.
+                if buffer.replace( "!", "" ) in self.rules:
+                    tokens += [ ( buffer.replace( "!", "" ), "!" in buffer ) ]
                     buffer = ''
 
-                    if brackets:
-                        raise Exception( "Grammar.parse: can't nest brackets" )
+                else:
+                    raise Exception( "Grammar.parse: no such rule '" + buffer + "'." )
 
-                    brackets = True
+            else:
+                buffer += char
 
-                elif char == ']':
-                    if not brackets:
-                        raise Exception( "Grammar.parse: unmatched bracket" )
+        if buffer != '':
+            tokens += [ buffer ]
 
-                    brackets = False
+        self._compiled[string] = tuple( tokens )
 
-                    # Mechanism for saving what result we got: put a ! somewhere in the [ ]-surrounded text.
-                    if buffer.replace( "!", "" ) in self.rules:
-                        fragments += [ self.parse( random.choice( self.rules[buffer.replace( "!", "" )] ) ) ]
+        return self._compiled[string]
 
-                        if "!" in buffer:
-                            self.saved += [ fragments[-1] ]
+    def alternatives( self, rule ):
 
-                        buffer = ''
+        """ Return the list of the compiled alternatives of 'rule'. """
 
-                    else:
-                        raise Exception( "Grammar.parse: no such rule '" + buffer + "'." )
+        return self._choices( rule )[0]
 
-                else:
-                    buffer += char
+    def _choices( self, rule ):
 
-            if buffer != '':
-                fragments += [ buffer ]
+        # The alternatives, how many there are, and how many random bits it takes to pick one.
+        if rule not in self._alternatives:
 
-            return "".join( fragments )
+            choices = [ ]
 
-        else:
-            return string
+            for alternative in self.rules[rule]:
+
+                tokens = self.compile( alternative )
+                choices += [ tokens[0] if len( tokens ) == 1 and type( tokens[0] ) == str else tokens ]
+
+            if not choices:
+                raise Exception( "Grammar.parse: rule '" + rule + "' has no alternatives." )
+
+            self._alternatives[rule] = ( choices, len( choices ), len( choices ).bit_length( ) )
+
+        return self._alternatives[rule]
+
+    def expand( self, template, rng = None, captures = None ):
+
+        """ Return a random expansion of 'template', choosing with 'rng' (default: our own .rng). What
+        each [!rule] expanded to is appended to the list 'captures', if given, in the order they were
+        finished (so a rule's own captures come before its). """
+
+        rng = rng or self.rng
+
+        return self._expand( self.compile( template ), rng, getattr( rng, "getrandbits", None ), captures )
+
+    def _expand( self, tokens, rng, getrandbits, captures ):
+
+        fragments = [ ]
+        append = fragments.append
+
+        for token in tokens:
+
+            if type( token ) == str:
+                append( token )
+                continue
+
+            ( rule, save ) = token
+            ( choices, count, bits ) = self._alternatives.get( rule ) or self._choices( rule )
+
+            if getrandbits:
+
+                # Just what random.Random.choice( ) does, without the calls it takes to do it, which
+                # are most of the time taken here. The same numbers are drawn, so the same seed
+                # still gives the same results.
+                choice = getrandbits( bits )
+
+                while choice >= count:
+                    choice = getrandbits( bits )
+
+                choice = choices[choice]
+
+            else:
+                choice = rng.choice( choices )
+
+            if type( choice ) != str:
+                choice = self._expand( choice, rng, getrandbits, captures )
+
+            append( choice )
+
+            if save and captures is not None:
+                captures += [ choice ]
+
+        return "".join( fragments )
+
+    def expandMany( self, template, count, rng = None ):
+
+        """ Return a list of 'count' expansions of 'template', each a tuple of its text and its own
+        list of captures (see .expand( )). """
+
+        tokens = self.compile( template )
+        rng = rng or self.rng
+        getrandbits = getattr( rng, "getrandbits", None )
+        results = [ ]
+
+        for i in range( 0, count ):
+            captures = [ ]
+            results += [ ( self._expand( tokens, rng, getrandbits, captures ), captures ) ]
+
+        return results
+
+    def batch( self, template, count, seed = None, workers = 1 ):
+
+        """ Like .expandMany( ), but always the same for the same 'seed', and shared out among up to
+        'workers' processes (None for one per CPU) if there are enough to be worth it (see
+        runShards( )). """
+
+        return [ result for results in runShards( expandShard, count, seed, ( self.rules, template ), workers )
+                 for result in results ]
+
+    def parse( self, string ):
+
+        """ Return a random expansion of 'string', using our own .rng, and append what any [!rule]s
+        expanded to to .saved. """
+
+        return self.expand( string, self.rng, self.saved )
 
     def rule( self, rule, new = None ):
 
         if new:
             self.rules[rule] = new
 
+            # Anything might have been compiled with the old one.
+            self._compiled = { }
+            self._alternatives = { }
+
         else:
             if rule in self.rules:
                 return self.rules[rule]
@@ -74,6 +199,69 @@ class Grammar:
             else:
                 return None
 
+# Worlds are generated this many rooms (or descriptions) at a time, each with its own seed (see
+# shardSeed( )), so that how many processes share the work makes no difference to the result.
+SHARD_SIZE = 10000
+
+def shardSeed( seed, shard ):
+
+    """ Return the seed for the shard numbered 'shard' of whatever 'seed' is for. The first is given
+    'seed' itself, so anything small enough to fit in one comes out as though it hadn't been split
+    up at all. """
+
+    return seed if shard == 0 else str( seed ) + "/" + str( shard )
+
+def runShards( function, count, seed, args = ( ), workers = 1 ):
+
+    """ Split up 'count' things to generate into shards of SHARD_SIZE, and return the list of what
+    function( first, last, seed, *args ) returns for each one: 'first' and 'last' are the range of
+    things to generate, and 'seed' the shard's own (see shardSeed( ); if 'seed' is None, one is
+    picked at random.) The shards are shared among up to 'workers' processes, or one per CPU if
+    that's None; 'function' and 'args' must be picklable, then. """
+
+    return list( iterShards( function, count, seed, args, workers ) )
+
+def iterShards( function, count, seed, args = ( ), workers = 1 ):
+
+    """ Generator version of runShards( ): each shard's result is yielded as soon as it's ready.
+    With only the one process, the next isn't started until it's been used, and otherwise only a
+    couple for each process are started ahead, so however many there are, only a few are ever
+    held at once. """
+
+    if seed is None:
+        seed = random.randrange( 2 ** 32 )
+
+    jobs = [ ( first, min( first + SHARD_SIZE, count ), shardSeed( seed, shard ) )
+             for ( shard, first ) in enumerate( range( 0, count, SHARD_SIZE ) ) ]
+
+    if workers == 1 or len( jobs ) < 2:
+
+        for job in jobs:
+            yield function( *job, *args )
+
+        return
+
+    with concurrent.futures.ProcessPoolExecutor( workers ) as pool:
+
+        ahead = 2 * ( workers or os.cpu_count( ) or 1 )
+        futures = collections.deque( )
+
+        for job in jobs:
+
+            futures.append( pool.submit( function, *job, *args ) )
+
+            if len( futures ) > ahead:
+                yield futures.popleft( ).result( )
+
+        while futures:
+            yield futures.popleft( ).result( )
+
+def expandShard( first, last, seed, rules, template ):
+
+    """ Generate one shard of Grammar.batch( ). """
+
+    return Grammar( rules ).expandMany( template, last - first, random.Random( seed ) )
+
 wallMaker = Grammar({
     'wallMat': [ 'stone', 'rock', 'wood', 'paper', 'earth', 'crystal', 'leafy vagueness', 'sand', 'skin', 'bark', 'foliage', 'needles', 'delicate tiles', 'agate', 'quartz', 'glass', 'iron', 'copper' ],
 
@@ -103,38 +291,180 @@ wallMaker = Grammar({
     'hidden': [ 'half-hidden', 'in plain view', 'almost impossible to spot', 'staring you in the face', 'which can only be found by touch' ]
 })
 
-if __name__ == '__main__':
+# What the exits of a maze without a layout are called, as they always have been: there's no Down,
+# unlike in topology.DIRECTIONS, whose exits are paired up with their ways back.
+linkNames = topology.DIRECTIONS[ 0:5 ]
+
+# What every room of a maze is described with. The door is saved, for the messages of its exits.
+description = "[walls]\n\na [doorMat] [!door], [hidden]."
+
+def generateMaze( roomCount = 25, linksPerRoom = None, extraProps = 0, propSize = 0, useGlobals = False,
+                  postscripts = True, seed = None, workers = 1, layout = None ):
+
+    """ Return a maze project (the dictionary to dump to a .yaml file) of 'roomCount' rooms, each
+    with exits to other random rooms: 'linksPerRoom' of them, or 2-4 if that's None. Beyond five,
+    the exits are called 'passage 6' and so on. Each room also gets 'extraProps' more properties
+    of 'propSize' characters each. If 'useGlobals', the name and POSTSCRIPT shared by every room
+    are given once in the ALL block instead; without 'postscripts', there are none. The same
+    'seed' always gives the same maze, however many processes it's generated by: up to 'workers'
+    (None for one per CPU), for more than SHARD_SIZE rooms (see runShards( ).)
+
+    Given a 'layout' (see topology.LAYOUTS), the exits are those of a topology.generateTopology( )
+    instead, with 'linksPerRoom' of them on average (default 3): every room can then be reached
+    from every other, and no room has two exits to the same one. """
+
+    return { "projectName": "maze",
+             "rooms": dict( iterMaze( roomCount, linksPerRoom, extraProps, propSize, useGlobals, postscripts,
+                                      seed, workers, layout ) ) }
+
+def iterMaze( roomCount = 25, linksPerRoom = None, extraProps = 0, propSize = 0, useGlobals = False,
+              postscripts = True, seed = None, workers = 1, layout = None ):
+
+    """ Yield the rooms of generateMaze( )'s maze, as ( ID, room ) pairs, as they're generated: the
+    ALL block first, if 'useGlobals'. """
+
+    shared = { "NAME": "Maze" }
+
+    if postscripts:
+        shared[ "POSTSCRIPT" ] = { "BUILD": [ "@set here=D", "@tel here=#63" ] }
+
+    if useGlobals:
+        yield ( "ALL", shared )
+
+    if seed is None:
+        seed = random.randrange( 2 ** 32 )
+
+    if layout:
+        exits = topology.generateTopology( layout, roomCount, shardSeed( seed, "topology" ), linksPerRoom ).exits
+
+    for ( rooms, doors ) in iterShards( generateRooms, roomCount, seed,
+                                        ( roomCount, linksPerRoom, extraProps, propSize, not layout ), workers ):
+        for ( ID, room ) in rooms.items( ):
+
+            if layout:
+                room["LINKS"] = { "room-" + str( dest ): exitProps( name, doors[ID] )
+                                  for ( dest, name ) in exits[ int( ID[ len( "room-" ): ] ) ] }
+
+            # Otherwise each room has the name and POSTSCRIPT itself. They're the very same objects in
+            # every room, so they take no more memory, but each is written out again in full (see
+            # build.YamlDumper.)
+            yield ( ID, room if useGlobals else dict( shared, **room ) )
+
+def buildMaze( **options ):
+
+    """ Return a build.Project for generateMaze( **options )'s maze, and a generator of the segments
+    building it (see build.Project.streamSegments( )), which adds each room to the project as it's
+    generated: the maze is built without being written out as YAML and read back in at all. """
 
-    linkNames = [ "[N]orth;north;n", "[S]outh;south;s", "[E]ast;east;e", "[W]est;west;w", "[U]p;up;u" ]
+    project = build.Project( "maze" )
+    rooms = iterMaze( **options )
+    layers = [ ]
 
-    project = { "projectName": "maze", "rooms": { } }
+    if options.get( "useGlobals" ):
+        layers = [ project.resolveProps( next( rooms )[1] ) ]
 
-    roomCount = 25
+    return ( project, project.streamSegments( rooms, layers ) )
 
-    for i in range(0, roomCount):
+def exitProps( name, door ):
 
-        desc = wallMaker.parse("[walls]\n\na [doorMat] [!door], [hidden].")
-        door = wallMaker.saved.pop( )
+    """ Return the properties of an exit called 'name' from a room whose door is 'door'. """
+
+    return { "NAME": name,
+             "succ": "You force your way through the " + door + ".",
+             "osucc": "forces their way through the " + door + ".",
+             "odrop": "emerges through an obscure way from some other part of the maze." }
+
+def generateRooms( first, last, seed, roomCount, linksPerRoom, extraProps, propSize, randomLinks = True ):
+
+    """ Generate the rooms numbered from 'first' up to 'last' of generateMaze( )'s maze, apart from
+    what they all share; 'seed' is the shard's own. Returns the rooms, and each one's door (by ID.)
+    Unless 'randomLinks', their LINKS are left empty, for the caller to fill in. """
+
+    rng = random.Random( seed )
+    rooms = { }
+    doors = { }
+
+    for i in range( first, last ):
+
+        captures = [ ]
+        desc = wallMaker.expand( description, rng, captures )
+        door = captures[-1]
         ID = "room-" + i.__str__()
 
-        project["rooms"][ ID ] = { "NAME": "Maze" }
-        project["rooms"][ ID ][ "LINKS" ] = { }
-        project["rooms"][ ID ][ "_/de" ] = desc
-        project["rooms"][ ID ][ "POSTSCRIPT" ] = { "BUILD": [ "@set here=D", "@tel here=#63" ] }
+        doors[ ID ] = door
+        rooms[ ID ] = { }
+        rooms[ ID ][ "LINKS" ] = { }
+        rooms[ ID ][ "_/de" ] = desc
+
+        for p in range( 0, extraProps ):
+            rooms[ ID ][ "_bench/" + str( p ) ] = ( desc * ( propSize // len( desc ) + 1 ) )[ :propSize ]
+
+        if not randomLinks:
+            continue
 
         # Each room shall have 2-3 links to other random rooms. Don't try to be consistent.
+        count = linksPerRoom if linksPerRoom is not None else rng.choice([ 2, 3, 3, 3, 3, 4, 4, 4 ])
+
         ln = linkNames.copy( )
-        random.shuffle(ln)
+        rng.shuffle(ln)
+        ln = [ topology.passage( n ) for n in range( count, len( linkNames ), -1 ) ] + ln
+
+        for i in range( 0, count ):
+            rooms[ ID ][ "LINKS" ][ "room-" + rng.choice( range(0, roomCount) ).__str__() ] = exitProps( ln.pop( ), door )
+
+    return ( rooms, doors )
+
+if __name__ == '__main__':
+
+    # python maze.py [--layout=grid|tree|clusters] [--build] [roomCount [seed]]
+    #
+    # Big mazes are generated by as many processes as there are CPUs. With --build, the commands to
+    # build the maze are written straight to maze-build.txt and maze-build.jsonl (as build.py -C
+    # would), rather than the maze to maze.gen.yaml.
+
+    layout = None
+    direct = False
+
+    while len( sys.argv ) > 1 and sys.argv[1].startswith( "--" ):
+
+        arg = sys.argv.pop( 1 )
+
+        if arg == "--build":
+            direct = True
+
+        elif arg.startswith( "--layout=" ):
+            layout = arg[ len( "--layout=" ): ]
+
+    options = { "roomCount": int( sys.argv[1] ) if len( sys.argv ) > 1 else 25,
+                "seed": int( sys.argv[2] ) if len( sys.argv ) > 2 else None, "workers": None, "layout": layout }
+
+    if direct:
+
+        ( project, segments ) = buildMaze( **options )
+
+        with open( "maze-build.txt", "w" ) as txt, open( "maze-build.jsonl", "w" ) as jsonl:
+
+            count = 0
+
+            for seg in segments:
+
+                if count:
+                    txt.write( "\n" )
+
+                build.writeCommands( txt, seg["commands"] )
+                jsonl.write( json.dumps( dict( seg, number = count ) ) + "\n" )
+                count += 1
+
+        for warning in project.check( ):
+            sys.stderr.write( "Warning: " + warning + "\n" )
+
+        print( "write: maze-build.txt, maze-build.jsonl (probably.)" )
 
-        for i in range( 0, random.choice([ 2, 3, 3, 3, 3, 4, 4, 4 ]) ):
-            project["rooms"][ ID ][ "LINKS" ][ "room-" + random.choice( range(0, roomCount) ).__str__() ] = {
-                "NAME": ln.pop( ),
-                "succ": "You force your way through the " + door + ".",
-                "osucc": "forces their way through the " + door + ".",
-                "odrop": "emerges through an obscure way from some other part of the maze." }
+    else:
 
-    with open("maze.gen.yaml", "w") as fh:
+        # Written as the rooms are generated, rather than all at once at the end.
+        with open("maze.gen.yaml", "w") as fh:
 
-        fh.write( yaml.dump( project ) )
+            build.writeProject( fh, "maze", iterMaze( **options ) )
 
-    print( "write: maze.gen.yaml (probably.)" )
+        print( "write: maze.gen.yaml (probably.)" )
@@ -0,0 +1,121 @@
+import os
+import tempfile
+import unittest
+
+import build
+
+class MergeTest ( unittest.TestCase ):
+
+    def setUp ( self ):
+
+        self.dir = tempfile.TemporaryDirectory( )
+        self.addCleanup( self.dir.cleanup )
+
+    def write ( self, name, text ):
+
+        filename = os.path.join( self.dir.name, name )
+
+        with open( filename, "w" ) as fh:
+            fh.write( text )
+
+        return filename
+
+    def test_config_only_merges_what_each_file_set ( self ):
+
+        # Only the first file sets an exit message; the second mustn't undo that with the defaults.
+        a = self.write( "a.yaml", "projectName: P\n"
+                                  "config:\n"
+                                  "    sge:\n"
+                                  "        succ: 'Off to !N.'\n"
+                                  "rooms:\n"
+                                  "    a1:\n"
+                                  "        NAME: A1\n"
+                                  "        LINKS: { b1: 'B;b' }\n" )
+        b = self.write( "b.yaml", "projectName: P\n"
+                                  "rooms:\n"
+                                  "    b1:\n"
+                                  "        NAME: B1\n"
+                                  "        LINKS: { a1: 'A;a' }\n" )
+
+        merged = build.compileProjects( [ a, b ], workers = 2 ).toCreate( )
+        stored = build.compileProjects( [ a, b ], store = build.RoomStore( ) ).toCreate( )
+
+        self.assertIn( "@succ $autodig/P/LINK-a1-TO-b1=Off to B1.", merged )
+        self.assertEqual( merged, stored )
+
+class HoistTest ( unittest.TestCase ):
+
+    def project ( self, rooms ):
+
+        return build.assembleProject( { "projectName": "P", "config": { "optimise": [ "hoist" ] }, "rooms": rooms } )
+
+    def test_rooms_that_move_themselves_keep_their_props ( self ):
+
+        project = self.project( { "a": { "_/de": "Same." }, "b": { "_/de": "Same." },
+                                  "c": { "_/de": "Same.", "POSTSCRIPT": { "BUILD": [ "@tel here=#63" ] } } } )
+
+        self.assertEqual( project.hoistProps( ), { "_/de": "Same." } )
+
+        commands = project.toCreate( )
+
+        self.assertIn( "@dig Untitled Room==autodig/P/c", commands )
+        self.assertIn( "@set $autodig/P/c=_/de:Same.", commands )
+        self.assertNotIn( "@set $autodig/P/a=_/de:Same.", commands )
+
+    def test_environment_is_reserved ( self ):
+
+        with self.assertRaises( Exception ):
+            self.project( { "_environment": { "NAME": "Mine" } } )
+
+class TeleportsTest ( unittest.TestCase ):
+
+    def project ( self, optimise ):
+
+        # a's commands need a teleport, b's can be run from anywhere, and the exit from b runs
+        # wherever the rooms' left off, which was b.
+        return build.assembleProject( { "projectName": "P", "config": { "optimise": optimise }, "rooms": {
+            "a": { "POSTSCRIPT": { "BUILD": [ "say hi" ] }, "LINKS": { "b": "B;b" } },
+            "b": { "POSTSCRIPT": { "BUILD": [ "@set here=D" ] },
+                   "LINKS": { "a": { "NAME": "A;a", "POSTSCRIPT": { "BUILD": [ "@set here=_x:1" ] } } } } } } )
+
+    def located ( self, project ):
+
+        """Return where each POSTSCRIPT segment's commands are run from, by segment, and the
+        number of the last command that makes something and the first POSTSCRIPT one."""
+
+        ( k, here, made, first ) = ( { }, None, 0, None )
+        commands = [ ( seg["key"], command ) for seg in project.iterSegments( "c" ) for command in seg["commands"] ]
+
+        for ( n, ( key, command ) ) in enumerate( commands ):
+
+            if not key.startswith( "POSTSCRIPT/" ):
+                made = n if command.startswith( ( "@dig ", "@action " ) ) else made
+                continue
+
+            first = n if first is None else first
+
+            if command.startswith( "@tel me=" ):
+                here = command[ len( "@tel me=" ): ]
+            else:
+                k.setdefault( key, [ ] ).append( ( here, command ) )
+
+        return ( k, made, first )
+
+    def test_postscripts_stay_where_they_were_run ( self ):
+
+        ( plain, _, _ ) = self.located( self.project( [ ] ) )
+
+        project = self.project( [ "teleports" ] )
+        ( optimised, made, first ) = self.located( project )
+
+        self.assertLess( made, first )
+        self.assertEqual( project.moves, { "made": 2, "avoided": 1 } )
+        self.assertEqual( optimised["POSTSCRIPT/autodig/P/b"], [ ( None, "@set $autodig/P/b=D" ) ] )
+
+        del plain["POSTSCRIPT/autodig/P/b"]
+        del optimised["POSTSCRIPT/autodig/P/b"]
+
+        self.assertEqual( optimised, plain )
+
+if __name__ == "__main__":
+    unittest.main( )
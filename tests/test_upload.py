@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+
+import build
+import fakemuck
+import maze
+import upload
+
+class UploadTest ( unittest.IsolatedAsyncioTestCase ):
+
+    async def start ( self, **options ):
+
+        self.muck = fakemuck.FakeMuck( **options )
+        self.port = await self.muck.start( )
+        self.addAsyncCleanup( self.muck.stop )
+
+        self.dir = tempfile.TemporaryDirectory( )
+        self.addCleanup( self.dir.cleanup )
+
+    def segments ( self ):
+
+        project = build.assembleProject( maze.generateMaze( 20, seed = 1 ) )
+
+        return ( project, list( project.iterSegments( "c" ) ) )
+
+    async def send ( self, segments, dbrefs = None, **options ):
+
+        return await upload.uploadSegments( "127.0.0.1", self.port, "builder", "password", segments,
+                                            os.path.join( self.dir.name, "checkpoint" ), "test", dbrefs,
+                                            rate = 1000, burst = 50, backoff = 0.3, **options )
+
+    async def test_flood_control_keeps_the_order ( self ):
+
+        await self.start( floodLimit = 30, floodWindow = 0.3 )
+
+        commands = [ "@set #1=n:" + str( n ) for n in range( 0, 200 ) ]
+        uploader = await upload.upload( "127.0.0.1", self.port, "builder", "password", commands,
+                                        rate = 1000, burst = 50, backoff = 0.3 )
+
+        self.assertTrue( self.muck.refused )
+        self.assertEqual( self.muck.log[1:], commands )
+        self.assertEqual( uploader.acknowledged, len( commands ) + 1 )
+
+    async def test_dbrefs_are_recorded ( self ):
+
+        await self.start( floodLimit = 30, floodWindow = 0.3 )
+
+        ( project, segments ) = self.segments( )
+        dbrefs = { }
+
+        await self.send( segments, dbrefs )
+
+        # FakeMuck numbers what it creates from 101, in the order the commands were carried out.
+        created = [ line.split( "=" )[-1] for line in self.muck.log if line.startswith( ( "@dig ", "@action " ) ) ]
+
+        self.assertTrue( self.muck.refused )
+        self.assertEqual( dbrefs, { reg: "#" + str( 101 + n ) for ( n, reg ) in enumerate( created ) } )
+        self.assertEqual( self.muck.log[1:], [ command for seg in segments for command in seg["commands"] ] )
+
+    async def test_resume_redoes_the_interrupted_segment ( self ):
+
+        ( project, segments ) = self.segments( )
+
+        # Hang up on the third command of the first segment with several, after the probe.
+        interrupted = next( n for ( n, seg ) in enumerate( segments ) if len( seg["commands"] ) > 3 )
+        before = [ command for seg in segments[ 0:interrupted ] for command in seg["commands"] ]
+
+        await self.start( dropAfter = 1 + len( before ) + 3 )
+
+        with self.assertRaises( upload.UploadError ):
+            await self.send( segments )
+
+        # Answers still on their way when the server hangs up can be lost, so the checkpoint may
+        # be a little behind, but everything it says was done was.
+        done = upload.loadCheckpoint( os.path.join( self.dir.name, "checkpoint" ) )["done"]
+        finished = [ command for seg in segments[ 0:done ] for command in seg["commands"] ]
+
+        self.assertLessEqual( done, interrupted )
+        self.assertEqual( self.muck.log[ 1:1 + len( finished ) ], finished )
+
+        first = len( self.muck.log )
+        await self.send( segments )
+
+        seg = segments[ done ]
+        rest = [ command for later in segments[ done + 1: ] for command in later["commands"] ]
+
+        self.assertFalse( seg["idempotent"] )
+        self.assertEqual( self.muck.log[ first + 1: ], seg["undo"] + seg["commands"] + rest )
+        self.assertFalse( os.path.exists( os.path.join( self.dir.name, "checkpoint" ) ) )
+
+if __name__ == "__main__":
+    unittest.main( )
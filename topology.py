@@ -0,0 +1,285 @@
+
+import sys # .argv
+import math
+import random
+
+# The names given to exits, in the order they're used, and which of them is the way back. Rooms with
+# more exits than that get passages, numbered from 7.
+DIRECTIONS = [ "[N]orth;north;n", "[S]outh;south;s", "[E]ast;east;e", "[W]est;west;w", "[U]p;up;u", "[D]own;down;d" ]
+OPPOSITES = [ 1, 0, 3, 2, 5, 4 ]
+
+NORTH = 0
+SOUTH = 1
+EAST = 2
+WEST = 3
+
+LAYOUTS = [ "grid", "tree", "clusters" ]
+
+# Which of DIRECTIONS each room has used is kept as a bit for each. For every combination of them,
+# the first direction still free (or None), and for every two, the first free in the one whose
+# opposite is free in the other; so the names can be found without searching each time.
+FIRST_FREE = [ next( ( d for d in range( 0, len( DIRECTIONS ) ) if not used & ( 1 << d ) ), None )
+               for used in range( 0, 1 << len( DIRECTIONS ) ) ]
+
+FIRST_PAIRED = [ [ next( ( d for d in range( 0, len( DIRECTIONS ) )
+                           if not used & ( 1 << d ) and not other & ( 1 << OPPOSITES[d] ) ), None )
+                   for other in range( 0, 1 << len( DIRECTIONS ) ) ]
+                 for used in range( 0, 1 << len( DIRECTIONS ) ) ]
+
+def passage( n ):
+
+    return "[P]assage " + str( n ) + ";passage " + str( n ) + ";p" + str( n )
+
+class Topology:
+
+    """ How a number of rooms, numbered from 0, are linked up: .exits[ room ] is the list of
+    ( destination, name ) of each exit from 'room'. No two exits from the same room have the same
+    name, or lead to the same room, and none leads back into the room it's in. """
+
+    def __init__( self, roomCount ):
+
+        self.roomCount = roomCount
+        self.exits = [ [ ] for i in range( 0, roomCount ) ]
+
+        # Which of DIRECTIONS each room has used (see FIRST_FREE), and its last passage number.
+        self._used = [ 0 ] * roomCount
+        self._passages = [ len( DIRECTIONS ) ] * roomCount
+
+    def linked( self, orig, dest ):
+
+        """ Return whether the room 'orig' already has an exit to 'dest' (or they're the same.) """
+
+        if orig == dest:
+            return True
+
+        for exit in self.exits[orig]:
+            if exit[0] == dest:
+                return True
+
+        return False
+
+    def free( self, room, direction ):
+
+        return not self._used[room] & ( 1 << direction )
+
+    def _add( self, orig, dest, direction ):
+
+        # Add the exit without checking it's needed, called 'direction' if that's still free,
+        # otherwise the first of DIRECTIONS that is, or else the next passage.
+        used = self._used[orig]
+
+        if direction is None or used & ( 1 << direction ):
+            direction = FIRST_FREE[used]
+
+        if direction is None:
+            self._passages[orig] += 1
+            name = passage( self._passages[orig] )
+
+        else:
+            self._used[orig] = used | ( 1 << direction )
+            name = DIRECTIONS[direction]
+
+        self.exits[orig].append( ( dest, name ) )
+
+    def link( self, orig, dest, direction = None ):
+
+        """ Add an exit from 'orig' to 'dest', called 'direction' (an index into DIRECTIONS) if that's
+        free, or whatever is. Returns False, and does nothing, if 'orig' already has an exit to
+        'dest', or is 'dest'. """
+
+        if self.linked( orig, dest ):
+            return False
+
+        self._add( orig, dest, direction )
+
+        return True
+
+    def linkBoth( self, orig, dest, direction = None ):
+
+        """ Add exits both ways between 'orig' and 'dest': see .link( ). If 'direction' isn't given,
+        the first one free in 'orig' whose opposite is free in 'dest' is used, so they're named
+        like each other's way back wherever possible. """
+
+        if self.linked( orig, dest ) or self.linked( dest, orig ):
+            return False
+
+        self._addBoth( orig, dest, direction )
+
+        return True
+
+    def _addBoth( self, orig, dest, direction = None ):
+
+        if direction is None:
+            direction = FIRST_PAIRED[ self._used[orig] ][ self._used[dest] ]
+
+        self._add( orig, dest, direction )
+        self._add( dest, orig, None if direction is None else OPPOSITES[direction] )
+
+    def reachable( self, start = 0 ):
+
+        """ Return how many rooms can be reached from room 'start' (including itself.) """
+
+        found = bytearray( self.roomCount )
+        found[start] = 1
+        frontier = [ start ]
+        count = 1
+
+        while frontier:
+
+            room = frontier.pop( )
+
+            for ( dest, name ) in self.exits[room]:
+                if not found[dest]:
+                    found[dest] = 1
+                    count += 1
+                    frontier += [ dest ]
+
+        return count
+
+def generateTopology( layout, roomCount, seed = None, linksPerRoom = None, clusterSize = 100 ):
+
+    """ Return a Topology of 'roomCount' rooms, laid out as 'layout' (one of LAYOUTS), with about
+    'linksPerRoom' exits from each room on average (default 3, and never fewer than 2 in all):
+
+    grid: the rooms are laid out in a square, and linked to the rooms north, south, east and west
+    of them, as a maze: through a random spanning tree of the grid, and as many more of the
+    neighbours as make up the number.
+
+    tree: every room is linked, both ways, to a random one before it, and then as many more exits
+    are added between random rooms (one way) as make up the number.
+
+    clusters: like tree, but within areas of 'clusterSize' rooms, each of which is linked to one
+    random area before it (through a random room in each, both ways.)
+
+    Every room can be reached from every other; the same 'seed' always gives the same result. The
+    random numbers are drawn in batches, in one go for each part of the work, rather than a room at
+    a time. """
+
+    if layout not in LAYOUTS:
+        raise Exception( "No such layout: '" + str( layout ) + "'." )
+
+    rng = random.Random( seed )
+    linksPerRoom = 3 if linksPerRoom is None else linksPerRoom
+
+    topology = Topology( roomCount )
+
+    if roomCount < 2:
+        return topology
+
+    if layout == "grid":
+        generateGrid( topology, rng, linksPerRoom )
+
+    elif layout == "tree":
+        generateTree( topology, rng, 0, roomCount )
+        addExtraLinks( topology, rng, linksPerRoom, roomCount )
+
+    else:
+        clusters = list( range( 0, roomCount, clusterSize ) )
+
+        for first in clusters:
+            generateTree( topology, rng, first, min( first + clusterSize, roomCount ) )
+
+        # Each area is linked up to one before it, just as rooms are in a tree.
+        uniform = rng.random
+
+        for ( c, parent ) in enumerate( [ int( uniform( ) * c ) for c in range( 1, len( clusters ) ) ], 1 ):
+
+            ( here, there ) = ( clusters[c], clusters[parent] )
+
+            topology.linkBoth( here + int( uniform( ) * ( min( here + clusterSize, roomCount ) - here ) ),
+                               there + int( uniform( ) * clusterSize ) )
+
+        addExtraLinks( topology, rng, linksPerRoom, clusterSize )
+
+    return topology
+
+def generateTree( topology, rng, first, last ):
+
+    """ Link each of the rooms numbered from 'first' up to 'last', after the first, both ways to a
+    random one before it. (None of them may have any exits yet.) """
+
+    uniform = rng.random
+    parents = [ first + int( uniform( ) * ( room - first ) ) for room in range( first + 1, last ) ]
+    addBoth = topology._addBoth
+
+    # Each room is new to the tree when it's linked, so there's no need to check it isn't already.
+    for ( room, parent ) in enumerate( parents, first + 1 ):
+        addBoth( parent, room )
+
+def addExtraLinks( topology, rng, linksPerRoom, span ):
+
+    """ Add about as many one-way exits between random rooms as it takes to give the rooms
+    'linksPerRoom' each on average, in all. Each leads to a room in the same block of 'span' rooms
+    (counting from 0) as the one it leads from. """
+
+    count = round( max( 0, linksPerRoom - 2 ) * topology.roomCount )
+    uniform = rng.random
+    roomCount = topology.roomCount
+
+    origins = [ int( uniform( ) * roomCount ) for i in range( 0, count ) ]
+    offsets = [ uniform( ) for i in range( 0, count ) ]
+
+    for ( orig, offset ) in zip( origins, offsets ):
+
+        first = orig - orig % span
+        topology.link( orig, first + int( offset * ( min( first + span, roomCount ) - first ) ) )
+
+def generateGrid( topology, rng, linksPerRoom ):
+
+    """ Link up the rooms of 'topology' as a grid: see generateTopology( ). """
+
+    roomCount = topology.roomCount
+    width = math.ceil( math.sqrt( roomCount ) )
+
+    # Every pair of neighbours, going east or south, in random order.
+    edges = [ ( room, room + 1, EAST ) for room in range( 0, roomCount - 1 ) if ( room + 1 ) % width ] + \
+            [ ( room, room + width, SOUTH ) for room in range( 0, roomCount - width ) ]
+    rng.shuffle( edges )
+
+    # Kruskal's algorithm: an edge is part of the spanning tree if it joins two rooms not already
+    # joined. Which are is kept track of by pointing each room towards another it's joined to.
+    leader = list( range( 0, roomCount ) )
+
+    def find( room ):
+
+        while leader[room] != room:
+            leader[room] = leader[ leader[room] ]
+            room = leader[room]
+
+        return room
+
+    spare = [ ]
+
+    addBoth = topology._addBoth
+
+    # No two edges join the same two rooms, so none needs checking.
+    for edge in edges:
+
+        ( a, b ) = ( find( edge[0] ), find( edge[1] ) )
+
+        if a == b:
+            spare.append( edge )
+
+        else:
+            leader[a] = b
+            addBoth( *edge )
+
+    for edge in spare[ 0:round( max( 0, linksPerRoom - 2 ) / 2 * roomCount ) ]:
+        addBoth( *edge )
+
+
+if __name__ == "__main__":
+
+    # python topology.py layout [roomCount [seed]]
+    #
+    # Prints how long it took, and how the exits turned out.
+
+    import time
+
+    started = time.perf_counter( )
+    topology = generateTopology( sys.argv[1], int( sys.argv[2] ) if len( sys.argv ) > 2 else 10000,
+                                 int( sys.argv[3] ) if len( sys.argv ) > 3 else None )
+
+    print( "%d rooms, %d exits in %.2fs; %d reachable from the first." % \
+           ( topology.roomCount, sum( len( exits ) for exits in topology.exits ),
+             time.perf_counter( ) - started, topology.reachable( ) ) )
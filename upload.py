@@ -0,0 +1,706 @@
+
+import sys # .argv
+import os
+import re
+import json
+import time
+import getpass
+import asyncio
+import collections
+
+import build
+
+# What MUCKs with flood control say instead of carrying out a command that arrived too quickly. A
+# command is only taken to have been refused (and sent again later) if every line of its output is
+# one of these, matched as a whole line: anything else might be the output of a command that was
+# carried out, which may well echo names of the user's own (a room called "Flood Plain"...)
+FLOOD_MESSAGES = [ "You're sending commands too fast! Slow down." ]
+
+# What the server says when @dig or @action creates something, giving its dbref.
+DBREF_PATTERN = re.compile( "(?i)created with (?:room )?number #?([0-9]+)" )
+
+# Markers the server is asked to put around the output of every command (with OUTPUTPREFIX and
+# OUTPUTSUFFIX), so we can tell which of our commands have been dealt with.
+PREFIX = "<<muck-builder:start>>"
+SUFFIX = "<<muck-builder:done>>"
+
+class UploadError ( Exception ):
+
+    """Raised when commands can't be sent: the connection is lost, logging in fails, the server
+    stops responding, or a command keeps being refused."""
+
+    pass
+
+class TokenBucket:
+
+    """Rate limiter: allows 'rate' commands a second on average, in bursts of up to 'burst'. The
+    rate can be halved (e.g. when the server complains), and then creeps back up to where it
+    started, a little with every command that goes through: additive increase, multiplicative
+    decrease."""
+
+    def __init__ ( self, rate, burst = 1 ):
+
+        self.maxRate = rate
+        self.rate = rate
+        self.burst = burst
+
+        self._tokens = burst
+        self._last = time.monotonic( )
+
+    async def take ( self ):
+
+        """Wait until another command may be sent."""
+
+        while True:
+
+            now = time.monotonic( )
+            self._tokens = min( self.burst, self._tokens + ( now - self._last ) * self.rate )
+            self._last = now
+
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+
+            await asyncio.sleep( ( 1 - self._tokens ) / self.rate )
+
+    def slowDown ( self ):
+
+        """Halve the rate (but not below a command every ten seconds), and use up any burst."""
+
+        self.rate = max( self.rate / 2, 0.1 )
+        self._tokens = 0
+
+    def speedUp ( self ):
+
+        """Raise the rate a little, up to what it was to begin with: by one command a second for
+        every second's worth of commands that go through."""
+
+        self.rate = min( self.maxRate, self.rate + 1 / self.rate )
+
+class Uploader:
+
+    """Sends commands to a MUCK over a telnet-style connection. Commands are pipelined -- up to
+    'window' can be on their way at once -- and limited to 'rate' a second (see TokenBucket.) The
+    server is asked to mark the end of the output of every command (OUTPUTSUFFIX), which is how
+    commands are known to have been carried out. A command the server refuses (see
+    'floodMessages', FLOOD_MESSAGES by default) is sent again, up to 'retries' times: nothing more
+    is sent until every command on its way has been dealt with, then everything refused is sent
+    again, in order, after a pause of 'backoff' seconds (more, if the server keeps refusing), and
+    only then anything new. The rate is halved, too, once for each time the server starts
+    refusing."""
+
+    def __init__ ( self, host, port, player, password, rate = 20.0, burst = 10, window = 32, timeout = 30.0,
+                   retries = 5, backoff = 2.0, floodMessages = FLOOD_MESSAGES, probe = "@version" ):
+
+        self.host = host
+        self.port = port
+        self.player = player
+        self.password = password
+
+        self.window = window
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.floodMessages = set( floodMessages )
+
+        # Any command that's harmless to run; used to find out whether logging in worked.
+        self.probe = probe
+
+        self.bucket = TokenBucket( rate, burst )
+
+        # Called as onOutput( command, lines ) for every command carried out.
+        self.onOutput = None
+
+        self.sent = 0
+        self.acknowledged = 0
+        self.retried = 0
+
+        # Commands carried out while one sent before them was waiting to be sent again: there's no
+        # stopping those that were already on their way when the server started refusing, unless
+        # it refuses them too (as MUCKs' flood control generally does.)
+        self.reordered = 0
+
+        self._reader = None
+        self._writer = None
+        self._listener = None
+
+        # [ command, attempts, sent at, number ] of each command not yet done, in the order sent,
+        # and of those refused, in the order they were first sent (by their numbers.)
+        self._outstanding = collections.deque( )
+        self._retry = collections.deque( )
+        self._numbered = 0
+        self._progress = asyncio.Event( )
+        self._pauseUntil = 0
+        self._refusals = 0
+        self._resending = False
+        self._slowedAt = 0
+        self._error = None
+
+    async def connect ( self ):
+
+        """Connect and log in. Raises UploadError if that doesn't work."""
+
+        try:
+            ( self._reader, self._writer ) = await asyncio.wait_for(
+                asyncio.open_connection( self.host, self.port ), self.timeout )
+
+        except ( OSError, asyncio.TimeoutError ) as e:
+            raise UploadError( "Can't connect to " + self.host + ":" + str( self.port ) + ": " + str( e ) )
+
+        self._listener = asyncio.ensure_future( self._listen( ) )
+
+        self._write( "connect " + self.player + " " + self.password )
+        self._write( "OUTPUTPREFIX " + PREFIX )
+        self._write( "OUTPUTSUFFIX " + SUFFIX )
+
+        await self.send( [ self.probe ] )
+
+    async def send ( self, commands ):
+
+        """Send every command from the iterable 'commands' (which is only read as fast as the
+        commands can be sent), and wait until they have all been carried out."""
+
+        commands = iter( commands )
+        command = None
+        exhausted = False
+
+        while True:
+
+            if self._error:
+                raise self._error
+
+            if ( self._retry or self._resending ) and self._outstanding:
+
+                # Something was refused. Before sending anything else, find out what else was, and
+                # then send those again one at a time, so everything is done in the original order.
+                await self._waitForProgress( )
+                continue
+
+            if command is None and not exhausted:
+                command = next( commands, None )
+                exhausted = command is None
+
+            if not self._retry and command is None:
+
+                if not self._outstanding:
+                    break
+
+                await self._waitForProgress( )
+                continue
+
+            if len( self._outstanding ) >= self.window:
+                await self._waitForProgress( )
+                continue
+
+            if time.monotonic( ) < self._pauseUntil:
+                await asyncio.sleep( self._pauseUntil - time.monotonic( ) )
+                continue
+
+            await self.bucket.take( )
+
+            if ( self._retry or self._resending ) and self._outstanding or time.monotonic( ) < self._pauseUntil:
+                # Refused while we were waiting.
+                continue
+
+            if self._retry:
+                self._resending = True
+                item = self._retry.popleft( )
+
+            else:
+                self._resending = False
+                item = [ command, 0, 0, self._numbered ]
+                self._numbered += 1
+                command = None
+
+            item[2] = time.monotonic( )
+            self._outstanding.append( item )
+            self._write( item[0] )
+            self.sent += 1
+
+    def firstPending ( self ):
+
+        """Return the number of the first command (counting every one sent since connecting, from 0)
+        that hasn't been carried out yet: every command before it has been, even if some after it
+        have too."""
+
+        pending = [ queue[0][3] for queue in ( self._outstanding, self._retry ) if queue ]
+
+        return min( pending ) if pending else self._numbered
+
+    async def close ( self ):
+
+        """Log out and disconnect."""
+
+        if self._writer:
+
+            self._write( "QUIT" )
+
+            try:
+                await self._writer.drain( )
+                self._writer.close( )
+
+            except OSError:
+                pass
+
+        if self._listener:
+            self._listener.cancel( )
+
+    def _write ( self, line ):
+
+        self._writer.write( ( line + "\r\n" ).encode( ) )
+
+    async def _waitForProgress ( self ):
+
+        """Wait until another command is done, or raise UploadError if none is for too long."""
+
+        self._progress.clear( )
+
+        try:
+            await asyncio.wait_for( self._progress.wait( ), self.timeout )
+
+        except asyncio.TimeoutError:
+
+            self._error = UploadError( "No response from the server for " + str( self.timeout ) + \
+                                       " seconds, with " + str( len( self._outstanding ) ) + \
+                                       " commands outstanding, starting with: " + self._outstanding[0][0] )
+
+        if self._error:
+            raise self._error
+
+    async def _listen ( self ):
+
+        """Read the server's output, matching it up with the commands sent."""
+
+        block = None
+
+        try:
+            while True:
+
+                line = await self._reader.readline( )
+
+                if not line:
+                    raise UploadError( "The server closed the connection." )
+
+                line = line.decode( errors = "replace" ).rstrip( "\r\n" )
+
+                if line == PREFIX:
+                    block = [ ]
+
+                elif line == SUFFIX:
+                    self._done( block or [ ] )
+                    block = None
+
+                elif block is not None:
+                    block += [ line ]
+
+                elif "does not exist" in line and "password" in line and not self.acknowledged:
+                    raise UploadError( "Couldn't log in as " + self.player + "." )
+
+        except UploadError as e:
+            self._error = e
+
+        except OSError as e:
+            self._error = UploadError( "Lost the connection: " + str( e ) )
+
+        except asyncio.CancelledError:
+            return
+
+        self._progress.set( )
+
+    def _done ( self, output ):
+
+        """Deal with the output of the oldest command still outstanding."""
+
+        if not self._outstanding:
+            return
+
+        item = self._outstanding.popleft( )
+
+        if output and all( line in self.floodMessages for line in output ):
+
+            item[1] += 1
+            self.retried += 1
+
+            if item[1] > self.retries:
+                self._error = UploadError( "The server kept refusing: " + item[0] )
+
+            # Kept in the order the commands were first sent, even when one is refused again while
+            # others are still waiting.
+            if self._retry and self._retry[0][3] > item[3]:
+                self._retry.appendleft( item )
+
+            else:
+                self._retry.append( item )
+
+            # A whole window's worth of commands may be refused at once, but that's only one reason
+            # to slow down, and pause: only those sent since the last time count. The pause is
+            # longer each time in a row the server refuses, in case it's still counting the
+            # commands that made it start.
+            if item[2] > self._slowedAt:
+                self._refusals += 1
+                self.bucket.slowDown( )
+                self._slowedAt = time.monotonic( )
+                self._pauseUntil = self._slowedAt + self.backoff * self._refusals
+
+        else:
+            self.acknowledged += 1
+            self._refusals = 0
+            self.bucket.speedUp( )
+
+            if self._retry and self._retry[0][3] < item[3]:
+                self.reordered += 1
+
+            if self.onOutput:
+                self.onOutput( item[0], output )
+
+        self._progress.set( )
+
+def dbrefRecorder ( dbrefs ):
+
+    """Return a function to use as Uploader.onOutput which records, in the dictionary 'dbrefs' (see
+    build.Project.useDbrefs( )), the dbref of everything @dig or @action registers, and forgets
+    anything that's @recycled."""
+
+    registered = { dbref: reg for ( reg, dbref ) in dbrefs.items( ) }
+
+    def record ( command, lines ):
+
+        match = re.match( "^@(?:dig|action) [^=]*=[^=]*=(.+)$", command )
+
+        if match:
+
+            for line in lines:
+
+                found = DBREF_PATTERN.search( line )
+
+                if found:
+                    dbrefs[ match.group( 1 ) ] = "#" + found.group( 1 )
+                    registered[ "#" + found.group( 1 ) ] = match.group( 1 )
+
+        elif command.startswith( "@recycle " ):
+
+            ref = command[ len( "@recycle " ): ]
+            dbrefs.pop( ref[1:] if ref.startswith( "$" ) else registered.pop( ref, None ), None )
+
+    return record
+
+def loadCheckpoint ( filename ):
+
+    """Return the checkpoint saved in 'filename' by saveCheckpoint( ), or None if there isn't
+    one."""
+
+    if not os.path.exists( filename ):
+        return None
+
+    with open( filename ) as fh:
+        return json.load( fh )
+
+def saveCheckpoint ( filename, checkpoint ):
+
+    """Write the dictionary 'checkpoint' to 'filename', replacing what was there in one go, so
+    there's never half a checkpoint to find."""
+
+    with open( filename + ".new", "w" ) as fh:
+        json.dump( checkpoint, fh )
+
+    os.replace( filename + ".new", filename )
+
+async def replay ( uploader, segments, checkpointFile, label ):
+
+    """Send the segments from the iterable 'segments' (see build.Project.iterSegments( )) with
+    'uploader', which must already be connected. Once every command in a segment has been carried
+    out, that's recorded in 'checkpointFile', with 'label' to say what was being sent; if there's
+    already a checkpoint for 'label' there, the segments it says were done are skipped. The segment
+    after those may have been partly run: if it isn't idempotent, its undo commands are sent before
+    it (or, if it has none, a warning is given.) The checkpoint is removed once everything has been
+    sent."""
+
+    checkpoint = loadCheckpoint( checkpointFile )
+
+    if checkpoint and checkpoint["label"] != label:
+        raise UploadError( checkpointFile + " is left over from sending something else (" + \
+                           checkpoint["label"] + "); remove it to start again." )
+
+    done = checkpoint["done"] if checkpoint else 0
+
+    # ( commands sent by the end of the segment, number of segments done by then, segment's key )
+    boundaries = collections.deque( )
+    sent = 0
+    first = uploader.firstPending( )
+    previous = uploader.onOutput
+
+    def commands ( ):
+
+        nonlocal sent
+
+        for ( number, seg ) in enumerate( segments ):
+
+            if number < done:
+
+                if number == done - 1 and seg["key"] != checkpoint["key"]:
+                    raise UploadError( "The segments don't match " + checkpointFile + "; they must " + \
+                                       "have changed since it was written. Remove it to start again." )
+
+                continue
+
+            k = seg["commands"]
+
+            if number == done and checkpoint and not seg["idempotent"]:
+
+                if seg["undo"] is not None:
+                    k = seg["undo"] + k
+
+                else:
+                    sys.stderr.write( "Warning: " + seg["key"] + " may have been partly done already, " + \
+                                      "and is being done again.\n" )
+
+            sent += len( k )
+            boundaries.append( ( sent, number + 1, seg["key"] ) )
+
+            yield from k
+
+    def onOutput ( command, lines ):
+
+        if previous:
+            previous( command, lines )
+
+        # Commands after one that was refused may be carried out before it's sent again, so only
+        # those before the first still to be done count.
+        done = uploader.firstPending( ) - first
+
+        while boundaries and done >= boundaries[0][0]:
+            ( _, number, key ) = boundaries.popleft( )
+            saveCheckpoint( checkpointFile, { "label": label, "done": number, "key": key } )
+
+    uploader.onOutput = onOutput
+
+    await uploader.send( commands( ) )
+
+    if os.path.exists( checkpointFile ):
+        os.remove( checkpointFile )
+
+async def upload ( host, port, player, password, commands, **options ):
+
+    """Connect to the MUCK at 'host':'port' as 'player', send all of 'commands', and disconnect.
+    'options' are passed on to Uploader. Returns the Uploader, for its statistics."""
+
+    uploader = Uploader( host, port, player, password, **options )
+
+    await uploader.connect( )
+
+    try:
+        await uploader.send( commands )
+
+    finally:
+        await uploader.close( )
+
+    return uploader
+
+async def uploadSegments ( host, port, player, password, segments, checkpointFile, label, dbrefs = None,
+                           **options ):
+
+    """Like upload( ), but sends 'segments', keeping a checkpoint as it goes -- see replay( ). If
+    'dbrefs' is given, the dbrefs of objects created and recycled are kept track of in it (see
+    dbrefRecorder( ).)"""
+
+    uploader = Uploader( host, port, player, password, **options )
+
+    await uploader.connect( )
+
+    if dbrefs is not None:
+        uploader.onOutput = dbrefRecorder( dbrefs )
+
+    try:
+        await replay( uploader, segments, checkpointFile, label )
+
+    finally:
+        await uploader.close( )
+
+    return uploader
+
+
+if __name__ == "__main__":
+
+    if len( sys.argv ) <= 3:
+        print ( """Usage:
+
+python upload.py [--rate=N] [--burst=N] [--window=N] [--flood-message=TEXT ...] [--restart] \\
+    [--dbrefs] host:port player \\
+    [-o[:room,room2,...] ...] filename.yaml [filename2.yaml directory ...]
+
+python upload.py [options as above] host:port player segments.jsonl
+
+python upload.py [options as above] -w[seconds] host:port player filename.yaml ...
+
+Sends the commands for the given operations (-c, -d, -u, -p or -i, with the same
+selections as build.py allows; -c is the default) straight to the MUCK, logged
+in as 'player'. The password is taken from the MUCK_PASSWORD environment
+variable, or asked for.
+
+Alternatively, sends the segments in a file written by build.py -C or
+--segments (e.g. projectName-build.jsonl.)
+
+Or, with -w, stays connected and keeps the MUCK up to date with the files as
+they change, like build.py -w.
+
+--rate is the most commands to send a second (default 20), --burst how many can
+be sent at once before that applies (default 10), and --window how many can be
+waiting for the server to deal with them at once (default 32). If the server
+refuses commands for flooding, the rate is halved, and they're sent again, in
+order, before anything else. A command only counts as refused if its output is
+nothing but "You're sending commands too fast! Slow down."; --flood-message=TEXT
+(as often as needed) gives the server's own message(s) instead, as whole lines.
+
+Progress is recorded after every room or exit, in projectName-upload.checkpoint
+(or segments.jsonl.checkpoint); if the upload is interrupted, running the same
+command again carries on from there, first undoing anything half-built. Use
+--restart to ignore the checkpoint and start from the beginning.
+
+--dbrefs (for project files, not segments) keeps track of the dbref of everything
+built (and forgets those of things recycled) in projectName-dbrefs.json, and refers to objects by dbref
+wherever one is known, rather than having the MUCK look up their registered
+names (see build.py --dbrefs.)
+
+""" )
+        quit ( )
+
+    options = { }
+    optimise = None
+    restart = False
+    useDbrefs = False
+    watch = None
+    opts = [ ]
+    args = [ ]
+
+    for arg in sys.argv[1:]:
+
+        match = re.match( "^--(rate|burst|window)=([0-9.]+)$", arg )
+
+        if match:
+            options[ match.group( 1 ) ] = float( match.group( 2 ) ) if match.group( 1 ) == "rate" else int( match.group( 2 ) )
+
+        elif arg.startswith( "--flood-message=" ):
+            options["floodMessages"] = options.get( "floodMessages", [ ] ) + [ arg[ len( "--flood-message=" ): ] ]
+
+        elif arg == "--restart":
+            restart = True
+
+        elif arg == "--dbrefs":
+            useDbrefs = True
+
+        elif re.match( "^-O", arg ):
+            optimise = arg[3:].split( "," ) if arg[2:3] == ":" else True
+
+        elif re.match( "^-w([0-9.]+)?$", arg ):
+            watch = float( arg[2:] or 1 )
+
+        elif re.match( "^-[cdupi]", arg ):
+            opts += [ arg ]
+
+        else:
+            args += [ arg ]
+
+    ( address, player ), filenames = args[0:2], args[2:]
+    ( host, port ) = address.rsplit( ":", 1 )
+
+    password = os.environ.get( "MUCK_PASSWORD" ) or getpass.getpass( "Password for " + player + ": " )
+
+    project = None
+    dbrefs = None
+
+    if watch is not None:
+
+        # One connection, kept open for as long as we're watching. The event loop only runs while
+        # something's being sent; the server's output waits for it in the meantime.
+        loop = asyncio.new_event_loop( )
+        watcher = build.Watcher( filenames, optimise )
+        uploader = Uploader( host, int( port ), player, password, **options )
+
+        loop.run_until_complete( uploader.connect( ) )
+
+        if useDbrefs:
+            dbrefs = build.loadDbrefs( watcher.project )
+            uploader.onOutput = dbrefRecorder( dbrefs )
+
+        def send ( project, segments ):
+
+            if dbrefs is not None:
+                project.useDbrefs( dbrefs )
+
+            started = time.monotonic( )
+            before = uploader.acknowledged
+
+            try:
+                loop.run_until_complete( uploader.send( command for seg in segments for command in seg["commands"] ) )
+
+            finally:
+                if dbrefs is not None:
+                    build.saveDbrefs( project, dbrefs )
+
+            if uploader.acknowledged > before:
+                sys.stderr.write( "%d commands in %.1fs.\n" % ( uploader.acknowledged - before, time.monotonic( ) - started ) )
+
+            build.reportOptimisations( project )
+
+        try:
+            build.watchProject( watcher, build.loadManifest( watcher.project ), send, watch )
+
+        finally:
+            loop.run_until_complete( uploader.close( ) )
+            loop.close( )
+
+        quit ( )
+
+    if len( filenames ) == 1 and filenames[0].endswith( ".jsonl" ):
+
+        # Segments written out by build.py.
+        jobs = [ ( filenames[0], build.readSegments( filenames[0] ), filenames[0] + ".checkpoint", None ) ]
+
+    else:
+
+        project = build.prepareProject( filenames, optimise,
+                                        operations = [ build.parseOperation( opt ) for opt in opts or [ "-c" ] ] )
+        # Only -i reads the manifest, and only the operations that build or remove anything
+        # change it.
+        manifest = build.loadManifest( project ) if any( opt[1] in "cduiC" for opt in opts or [ "-c" ] ) else None
+        jobs = [ ]
+
+        if useDbrefs:
+            dbrefs = build.loadDbrefs( project )
+            project.useDbrefs( dbrefs )
+
+        for opt in opts or [ "-c" ]:
+            ( op, targets, closure ) = build.parseOperation( opt )
+            jobs += [ ( opt, project.iterSegments( op, targets, manifest, **closure ),
+                        project.name + "-upload.checkpoint", ( op, targets, closure ) ) ]
+
+    for ( label, segments, checkpointFile, operation ) in jobs:
+
+        if restart and os.path.exists( checkpointFile ):
+            os.remove( checkpointFile )
+
+        started = time.monotonic( )
+
+        try:
+            uploader = asyncio.run( uploadSegments( host, int( port ), player, password, segments,
+                                                    checkpointFile, label, dbrefs, **options ) )
+
+        finally:
+            # Whatever was built before anything went wrong is still there.
+            if dbrefs is not None:
+                build.saveDbrefs( project, dbrefs )
+
+        sys.stderr.write( "%s: %d commands in %.1fs (%d sent again after flood control.)\n" % \
+                          ( label, uploader.acknowledged - 1, time.monotonic( ) - started, uploader.retried ) )
+
+        if uploader.reordered:
+            sys.stderr.write( "Warning: %d commands were carried out before one sent earlier, which the server " \
+                              "refused at first.\n" % uploader.reordered )
+
+        if project:
+            build.reportOptimisations( project )
+
+        if operation and operation[0] in "cduiC":
+            ( op, targets, closure ) = operation
+            project.recordManifest( manifest, op, targets, **closure )
+            build.saveManifest( project, manifest )